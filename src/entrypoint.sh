@@ -4,10 +4,24 @@
 /app/src/migrate.sh
 /app/src/collectstatic.sh
 
-# Start Gunicorn
-exec gunicorn order.wsgi:application \
+# Start Gunicorn, size GUNICORN_WORKERS from manage.py loadgen --url runs.
+# SERVER_MODE=asgi runs uvicorn workers, each serving many concurrent tablets on one event loop.
+# It defaults to a single worker: the kitchen feed (shop.feed) is per process, so with more workers
+# a screen only gets pushed the writes of its own worker, and the others show up on its 30s poll.
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    APP=order.asgi:application
+    WORKER_CLASS=uvicorn_worker.UvicornWorker
+    WORKERS=${GUNICORN_WORKERS:-1}
+else
+    APP=order.wsgi:application
+    WORKER_CLASS=sync
+    WORKERS=${GUNICORN_WORKERS:-3}
+fi
+
+exec gunicorn $APP \
+    --worker-class $WORKER_CLASS \
     --bind 0.0.0.0:8000 \
-    --workers 3 \
+    --workers $WORKERS \
     --max-requests 1200 \
     --limit-request-line 4094 \
-    --limit-request-fields 100
\ No newline at end of file
+    --limit-request-fields 100
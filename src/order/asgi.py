@@ -2,6 +2,11 @@
 ASGI config for order project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Long-lived streams such as the kitchen feed (shop.views.UndeliveredItemsStreamView)
+are only served when the project runs under this entry point. entrypoint.sh serves
+it with uvicorn workers when SERVER_MODE=asgi. The image, files and charts views are
+async and the shop middleware is async capable, so a slow S3 read waits in a worker
+thread instead of blocking a whole process.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
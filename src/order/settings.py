@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     ### django apps
     'accounts',
     'shop',
@@ -64,8 +65,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'shop.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -155,6 +157,12 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [ BASE_DIR / 'static' ]
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    # plotly.min.js comes from the installed plotly package
+    'shop.staticfiles.PlotlyFinder',
+]
 STATIC_ROOT = BASE_DIR / 'static-root'
 
 # Default primary key field type
@@ -181,10 +189,31 @@ AUTH_USER_MODEL = 'accounts.User'
 AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID", default=None, cast=str)
 AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY", default=None, cast=str)
 AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME", default=None, cast=str)
+# Optional S3-compatible endpoint, e.g. a local MinIO
+AWS_S3_ENDPOINT_URL = config("AWS_S3_ENDPOINT_URL", default=None)
 
 MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Image serving: 'presigned' signs the uploaded file per request,
+# 'local' / 's3' copy images to content-hashed keys served with immutable caching.
+IMAGE_BACKEND = config("IMAGE_BACKEND", default='presigned')
+IMAGE_ROOT = config("IMAGE_ROOT", default=str(BASE_DIR / 'media'))
+# Optional CDN in front of the hashed images, e.g. https://cdn.example.com
+IMAGE_CDN_URL = config("IMAGE_CDN_URL", default=None)
+# Threads resizing uploads into srcset thumbnails after the request; 0 resizes inline on commit
+THUMBNAIL_WORKERS = config("THUMBNAIL_WORKERS", default=2, cast=int)
+
+# Menu pages are served from an in-process snapshot. Name a CACHES alias shared by all workers (e.g. Redis)
+# to invalidate it everywhere on a write; without one, other workers pick up writes after MENU_CACHE_SECONDS.
+MENU_CACHE_ALIAS = config("MENU_CACHE_ALIAS", default=None)
+MENU_CACHE_SECONDS = config("MENU_CACHE_SECONDS", default=60, cast=int)
+
+# Per request SQL / template / S3 timings as Server-Timing headers and /metrics/ totals, off by default
+INSTRUMENTATION = config("INSTRUMENTATION", default=False, cast=bool)
+# Bearer token a Prometheus scraper sends to /metrics/, staff users need none
+INSTRUMENTATION_TOKEN = config("INSTRUMENTATION_TOKEN", default=None)
+
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 
 CRISPY_TEMPLATE_PACK = "bootstrap4"
\ No newline at end of file
@@ -1,3 +1,3 @@
-from .client import S3Client
+from .client import S3Client, shared_client
 
-__all__ = ["S3Client"]
\ No newline at end of file
+__all__ = ["S3Client", "shared_client"]
@@ -1,6 +1,10 @@
+import time
+import threading
 import boto3
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from botocore.client import Config
+from botocore.exceptions import ClientError
 
 @dataclass
 class S3Client:
@@ -10,10 +14,20 @@ class S3Client:
         aws_secret_access_key='aws_secret
         default_bucket_name='default_bucket_name'
         )
+    url = client.presigned_url('product/1/burger.jpg')
+
+    Prefer s3.shared_client(...), which returns one pooled instance per process.
     """
     aws_access_key_id: str
     aws_secret_access_key: str
     default_bucket_name: str
+    endpoint_url: str = None
+    max_pool_connections: int = 50
+    url_expires_in: int = 1000
+    # cached URLs are dropped this many seconds before they expire
+    url_expiry_margin: int = 200
+    _urls: dict = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def __post_init__(self):
         self.client = self.create_s3_client()
@@ -25,8 +39,88 @@ class S3Client:
         return boto3.client(
             's3',
             region_name='eu-north-1',
-            config=Config(signature_version='s3v4'),
+            endpoint_url=self.endpoint_url,
+            config=Config(signature_version='s3v4', max_pool_connections=self.max_pool_connections),
             aws_access_key_id=self.aws_access_key_id,
             aws_secret_access_key=self.aws_secret_access_key
         )
-    
+
+    def presigned_url(self, key):
+        """
+        Presigned GET url for key, reused until shortly before it expires.
+        Signing is local (no request to S3), the cache saves the HMAC work per tile.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._urls.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.default_bucket_name,
+                'Key': key
+            },
+            ExpiresIn=self.url_expires_in
+        )
+        with self._lock:
+            if len(self._urls) > 4096:
+                self._urls = {k: v for k, v in self._urls.items() if v[1] > now}
+            self._urls[key] = (url, now + self.url_expires_in - self.url_expiry_margin)
+        return url
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.default_bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put_object(self, key, body, content_type, cache_control=None):
+        params = {
+            'Bucket': self.default_bucket_name,
+            'Key': key,
+            'Body': body,
+            'ContentType': content_type,
+        }
+        if cache_control:
+            params['CacheControl'] = cache_control
+        self.client.put_object(**params)
+
+    def open(self, key):
+        """Streaming body of the object, or None if it does not exist."""
+        try:
+            return self.client.get_object(Bucket=self.default_bucket_name, Key=key)['Body']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def delete(self, keys):
+        """Delete up to 1000 keys in one request, missing keys are ignored."""
+        keys = list(keys)
+        if keys:
+            self.client.delete_objects(
+                Bucket=self.default_bucket_name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        for key in keys:
+            self.forget(key)
+
+    def forget(self, key):
+        """Drop a cached url, e.g. after the object was deleted."""
+        with self._lock:
+            self._urls.pop(key, None)
+
+
+@lru_cache(maxsize=None)
+def shared_client(aws_access_key_id, aws_secret_access_key, default_bucket_name, endpoint_url=None):
+    """Process-wide S3Client; boto3 clients are thread-safe and keep their connection pool."""
+    return S3Client(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        default_bucket_name=default_bucket_name,
+        endpoint_url=endpoint_url,
+    )
@@ -0,0 +1,243 @@
+import gc
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from .models import Section, Table, MenuCategory, Product, MenuItem, Order, OrderItem
+from .menu_cache import invalidate_menu
+from .rollups import rebuild_rollups
+
+# A day of a mid-sized restaurant, repeated over three months
+DEFAULT_SCALE = {
+    'sections': 6,
+    'tables_per_section': 12,
+    'categories': 10,
+    'items_per_category': 30,
+    'days': 90,
+    'orders_per_day': 60,
+    'items_per_order': 4,
+    'open_orders': 20,
+}
+# p50 growth over the baseline, plus LATENCY_SLACK_MS, reported as a warning. Latency depends on the machine
+# and p99 of a few dozen samples is their maximum, so only query counts and status codes fail a run.
+DEFAULT_TOLERANCE = 0.5
+LATENCY_SLACK_MS = 5.0
+QUERY_STRINGS = {
+    # the tablets post the quantity in the query string
+    'order-item-create-view': 'quantity=1',
+}
+
+
+@contextmanager
+def no_auto_now(*fields):
+    """Let bulk_create keep explicit created timestamps."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def seed(scale=None, seed=1):
+    """Fill an empty database with a realistic menu, floor plan and order history. Returns the scale used."""
+    scale = {**DEFAULT_SCALE, **(scale or {})}
+    rng = random.Random(seed)
+
+    sections = Section.objects.bulk_create([Section(name=f'Section {i}') for i in range(scale['sections'])])
+    tables = Table.objects.bulk_create([
+        Table(name=f'{section.name[-1]}{i}', section=section)
+        for section in sections for i in range(scale['tables_per_section'])
+    ])
+    categories = MenuCategory.objects.bulk_create([
+        MenuCategory(name=f'Category {i}', handle=f'category-{i}') for i in range(scale['categories'])
+    ])
+    products = Product.objects.bulk_create([
+        Product(name=f'{category.name} item {i}', size='regular', unit='plate',
+                handle=f'{category.handle}-item-{i}-regular-plate')
+        for category in categories for i in range(scale['items_per_category'])
+    ])
+    menu_items = MenuItem.objects.bulk_create([
+        MenuItem(product=product, category=categories[n // scale['items_per_category']], handle=product.handle,
+                 price=Decimal(rng.randrange(300, 3000)) / 100)
+        for n, product in enumerate(products)
+    ])
+
+    now = timezone.now()
+    orders, lines = [], []
+    for day in range(scale['days'], 0, -1):
+        for _ in range(scale['orders_per_day']):
+            created = now - timedelta(days=day, minutes=rng.randrange(10 * 60))
+            order_lines = [(rng.choice(menu_items), rng.randrange(1, 4), created)
+                           for _ in range(rng.randrange(1, scale['items_per_order'] * 2))]
+            total = sum(menu_item.price * quantity for menu_item, quantity, _ in order_lines)
+            orders.append(Order(table=rng.choice(tables), created=created, updated=created,
+                                is_finished=True, is_paid=True, total=total))
+            lines.append(order_lines)
+    open_tables = rng.sample(tables, min(scale['open_orders'], len(tables)))
+    for table in open_tables:
+        created = now - timedelta(minutes=rng.randrange(120))
+        order_lines = [(rng.choice(menu_items), 1, created) for _ in range(scale['items_per_order'])]
+        orders.append(Order(table=table, created=created, updated=created,
+                            total=sum(menu_item.price for menu_item, _, _ in order_lines)))
+        lines.append(order_lines)
+
+    with no_auto_now(Order._meta.get_field('created'), OrderItem._meta.get_field('created')):
+        orders = Order.objects.bulk_create(orders, batch_size=2000)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menu_item=menu_item, quantity=quantity, price=menu_item.price,
+                      created=created, is_delivered=order.is_finished)
+            for order, order_lines in zip(orders, lines) for menu_item, quantity, created in order_lines
+        ], batch_size=2000)
+    Table.objects.filter(id__in=[table.id for table in open_tables]).update(in_use=True)
+    rebuild_rollups(chunk_size=5000)
+    invalidate_menu()
+    return scale
+
+
+def route_kwargs():
+    """
+    URL kwargs by converter name, pointing at seeded objects (an open order, its table, ...),
+    and the overrides of routes that use a name differently.
+    """
+    order = Order.objects.filter(is_finished=False).select_related('table').order_by('id').first()
+    menu_item = MenuItem.objects.select_related('product', 'category').order_by('id').first()
+    item = order.orderitem_set.order_by('id').first()
+    free_table = Table.objects.filter(in_use=False).order_by('id').first()
+    overrides = {
+        # item_id is a menu item here, an order item elsewhere
+        'order-item-create-view': {'item_id': menu_item.id},
+    }
+    return order, overrides, {
+        'order_id': order.id,
+        'item_id': item.id,
+        'table_id': free_table.id,
+        'section_id': order.table.section_id,
+        'category_id': menu_item.category_id,
+        'menu_item_id': menu_item.id,
+        'product_id': menu_item.product_id,
+        'handle': menu_item.product.handle,
+        'category_handle': menu_item.category.handle,
+        'key': 'img/00/' + '0' * 64 + '.jpg',
+    }
+
+
+def scenarios(urlpatterns):
+    """
+    (name, method, url pattern, htmx) for every route: a full page and an htmx GET where the view
+    has get(), a POST where it has post(). POSTs run in a rolled back transaction, so they repeat on the same data.
+    """
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or not hasattr(pattern.callback, 'view_class'):
+            continue
+        view_class = pattern.callback.view_class
+        if hasattr(view_class, 'get'):
+            yield f'GET {pattern.name}', 'get', pattern, False
+            yield f'GET {pattern.name} (htmx)', 'get', pattern, True
+        if hasattr(view_class, 'post'):
+            yield f'POST {pattern.name} (htmx)', 'post', pattern, True
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def measure(client, method, url, htmx, iterations):
+    """
+    Query count, p50/p99 latency (ms), response bytes and status of a request, over iterations runs.
+    The garbage collector is off while timing, as in timeit.
+    """
+    headers = {'HTTP_HX_REQUEST': 'true'} if htmx else {}
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            # the query log is a bounded deque, start each capture from empty
+            reset_queries()
+            with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, **headers)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+                transaction.set_rollback(True)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {
+        'status': response.status_code,
+        'queries': len(ctx.captured_queries),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'bytes': len(content),
+    }
+
+
+def run(urlpatterns, iterations=20, warmup=2):
+    """Benchmark every route against the seeded database. Returns {scenario: metrics}."""
+    order, overrides, kwargs = route_kwargs()
+    client = Client(raise_request_exception=False)
+    results = {}
+    for name, method, pattern, htmx in scenarios(urlpatterns):
+        route = {**kwargs, **overrides.get(pattern.name, {})}
+        url = reverse(pattern.name, kwargs={key: route[key] for key in pattern.pattern.converters})
+        if pattern.name in QUERY_STRINGS:
+            url = f'{url}?{QUERY_STRINGS[pattern.name]}'
+        session = client.session
+        session['order_id'] = order.id
+        session.save()
+        if warmup:
+            measure(client, method, url, htmx, warmup)
+        results[name] = {'url': url, **measure(client, method, url, htmx, iterations)}
+    return results
+
+
+def compare(results, baseline):
+    """Regressions of results against a baseline: a server error, a changed status code or any extra query."""
+    regressions = []
+    for name, metrics in results.items():
+        if metrics['status'] >= 500:
+            regressions.append(f"{name}: status {metrics['status']}")
+        budget = baseline.get(name)
+        if budget is None:
+            continue
+        if metrics['status'] < 500 and metrics['status'] != budget['status']:
+            regressions.append(f"{name}: status {metrics['status']}, baseline {budget['status']}")
+        if metrics['queries'] > budget['queries']:
+            regressions.append(f"{name}: {metrics['queries']} queries, budget {budget['queries']}")
+    return regressions
+
+
+def slower(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Routes whose median latency grew beyond the tolerance over the baseline's. Informational only."""
+    warnings = []
+    for name, metrics in results.items():
+        budget = baseline.get(name)
+        if budget is None:
+            continue
+        limit = budget['p50_ms'] * (1 + tolerance) + LATENCY_SLACK_MS
+        if metrics['p50_ms'] > limit:
+            warnings.append(f"{name}: p50_ms {metrics['p50_ms']}, baseline {budget['p50_ms']}")
+    return warnings
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def write_baseline(path, results, scale, iterations):
+    with open(path, 'w') as f:
+        json.dump({'scale': scale, 'iterations': iterations, 'results': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -0,0 +1,38 @@
+import hashlib
+from .models import Order, OrderItem, Table
+
+
+def signature(prefix, rows):
+    """Collapse (id, version, ...) rows into a short ETag value."""
+    digest = hashlib.md5(repr(list(rows)).encode(), usedforsecurity=False).hexdigest()
+    return f"{prefix}-{digest}"
+
+
+def open_orders_etag(request, *args, **kwargs):
+    # the list shows section names, which carry no version of their own
+    rows = Order.objects.filter(is_finished=False).order_by('id').values_list(
+        'id', 'version', 'table__version', 'table__section__name')
+    return signature('open-orders', rows)
+
+
+def undelivered_items_etag(request, *args, **kwargs):
+    # what the rows render, product names and table names included, so a rename is not answered with a 304
+    rows = OrderItem.objects.filter(order__is_finished=False, is_delivered=False).order_by('id').values_list(
+        'id', 'quantity', 'menu_item__product__name', 'menu_item__product__unit', 'menu_item__product__size',
+        'order__table__name')
+    return signature('undelivered-items', rows)
+
+
+def order_items_etag(request, *args, **kwargs):
+    order = getattr(request, 'order', None)
+    if not order:
+        return None
+    rows = order.orderitem_set.order_by('id').values_list(
+        'id', 'menu_item__product__name', 'menu_item__product__unit', 'menu_item__product__size')
+    return signature(f"order-{order.id}-{order.version}", rows)
+
+
+def available_tables_etag(request, section_id, *args, **kwargs):
+    # only table fields are rendered, their version covers renames
+    rows = Table.objects.filter(section__id=section_id).order_by('id').values_list('id', 'version')
+    return signature(f'section-{section_id}-tables', rows)
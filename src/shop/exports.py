@@ -0,0 +1,139 @@
+import csv
+import io
+from datetime import datetime, time, timedelta
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from .models import Order
+
+EXPORT_CHUNK_SIZE = 2000
+# (column, lookup on Order); one row per order item, orders without items get one row of blanks
+EXPORT_COLUMNS = (
+    ('order_id', 'id'),
+    ('created', 'created'),
+    ('table', 'table__name'),
+    ('section', 'table__section__name'),
+    ('is_finished', 'is_finished'),
+    ('order_total', 'total'),
+    ('item_id', 'orderitem__id'),
+    ('menu_item', 'orderitem__menu_item__product__name'),
+    ('quantity', 'orderitem__quantity'),
+    ('price', 'orderitem__price'),
+    ('is_delivered', 'orderitem__is_delivered'),
+)
+
+
+def order_rows(date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Orders joined with their items as tuples, in EXPORT_COLUMNS order.
+    Read through a server-side cursor chunk_size rows at a time, so memory stays flat.
+    """
+    orders = Order.objects.all()
+    # half-open datetime bounds keep the created index usable
+    if date_from:
+        orders = orders.filter(created__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        orders = orders.filter(created__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)))
+    lookups = [lookup for _, lookup in EXPORT_COLUMNS]
+    return orders.order_by('id', 'orderitem__id').values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+def csv_chunks(rows, rows_per_chunk=EXPORT_CHUNK_SIZE):
+    """Encode rows as CSV, yielding one string per rows_per_chunk rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column for column, _ in EXPORT_COLUMNS])
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('order_id', pa.int64()),
+        ('created', pa.timestamp('us', tz='UTC')),
+        ('table', pa.string()),
+        ('section', pa.string()),
+        ('is_finished', pa.bool_()),
+        ('order_total', pa.decimal128(12, 2)),
+        ('item_id', pa.int64()),
+        ('menu_item', pa.string()),
+        ('quantity', pa.int64()),
+        ('price', pa.decimal128(10, 2)),
+        ('is_delivered', pa.bool_()),
+    ])
+
+
+def parquet_chunks(rows, rows_per_group=EXPORT_CHUNK_SIZE * 25):
+    """Encode rows as Parquet, one row group per rows_per_group rows, yielding bytes as each group is written."""
+    # pyarrow is heavy to import, only pay for it when Parquet is asked for
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+
+    def write(batch):
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= rows_per_group:
+            write(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write(batch)
+    writer.close()
+    yield sink.drain()
+
+
+async def achunks(chunks):
+    """
+    Async iterator over encoded chunks. Under ASGI, Django buffers a sync streaming iterator whole before
+    sending it; each chunk is produced in the request's ORM thread instead, so memory stays flat.
+    """
+    done = object()
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, done)) is not done:
+        yield chunk
+
+
+EXPORT_FORMATS = {
+    # format: (content type, file extension, encoder)
+    'csv': ('text/csv', 'csv', csv_chunks),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', parquet_chunks),
+}
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+
+class FeedBroker:
+    """
+    In-process publish/subscribe hub for the kitchen feed.
+    Subscribers are asyncio queues owned by the ASGI event loop,
+    publishers are the (sync) OrderItem signal handlers.
+
+    queue = broker.subscribe()
+    event, data = await queue.get()
+    broker.unsubscribe(queue)
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, loop=None):
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[queue] = loop or asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event, data):
+        """Thread-safe: hand the event over to every subscriber's event loop."""
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            if loop.is_closed():
+                self.unsubscribe(queue)
+                continue
+            loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+
+
+broker = FeedBroker()
+
+
+def format_event(event, data):
+    """Encode an event in the text/event-stream format."""
+    lines = ''.join(f"data: {line}\n" for line in str(data).splitlines() or [''])
+    return f"event: {event}\n{lines}\n"
@@ -1,12 +1,12 @@
 from django import forms
 from .models import Table, Order, OrderItem, Product, MenuItem, MenuCategory, Section
+from .images import is_hashed_key
 from django.urls import reverse
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Div, Submit, HTML, Field
 from crispy_forms.bootstrap import InlineField
-from PIL import Image
-from io import BytesIO
-from django.core.files import File
+from django.utils import timezone
+from datetime import timedelta
 
 class InactiveTableForm(forms.Form):
     table = forms.ChoiceField()
@@ -56,19 +56,11 @@ class ProductForm(forms.ModelForm):
         old_image = self.instance.image
         new_image = self.cleaned_data.get('image')
 
-        if old_image and old_image != new_image:
+        # a hashed image may be shared by identical uploads, it stays
+        if old_image and old_image != new_image and not is_hashed_key(old_image.name):
             old_image.delete(save=False)
 
-        if new_image:
-            img = Image.open(new_image)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                output = BytesIO()
-                img.save(output, format='JPEG', quality=75)
-                output.seek(0)
-                new_image = File(output, name=new_image.name)
-
+        # thumbnails are generated after the save, see shop.thumbnails
         return new_image
     
     def __init__(self, *args, **kwargs):
@@ -113,19 +105,11 @@ class MenuCategoryForm(forms.ModelForm):
         old_image = self.instance.image
         new_image = self.cleaned_data.get('image')
 
-        if old_image and old_image != new_image:
+        # a hashed image may be shared by identical uploads, it stays
+        if old_image and old_image != new_image and not is_hashed_key(old_image.name):
             old_image.delete(save=False)
 
-        if new_image:
-            img = Image.open(new_image)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                output = BytesIO()
-                img.save(output, format='JPEG', quality=75)
-                output.seek(0)
-                new_image = File(output, name=new_image.name)
-
+        # thumbnails are generated after the save, see shop.thumbnails
         return new_image
     
     def __init__(self, *args, **kwargs):
@@ -171,3 +155,54 @@ class SectionForm(forms.ModelForm):
             *[Div(InlineField(field), css_class='col-md-6 offset-md-3 mb-3') for field in self.fields],
             Submit('submit', 'Save', css_class='btn btn-dark mt-3 mb-3 col-md-6 offset-md-3')
         )
+
+
+GRANULARITY_CHOICES = [
+    ('hour', 'Hour'),
+    ('day', 'Day'),
+    ('week', 'Week'),
+    ('month', 'Month'),
+]
+
+class ChartsFilterForm(forms.Form):
+    """Date window and granularity for the charts. Defaults to the last 30 days by day."""
+    default_days = 30
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        today = timezone.now().date()
+        # 'from' is a keyword, so the fields are declared here instead of on the class.
+        self.fields['from'] = forms.DateField(required=False, initial=today - timedelta(days=self.default_days),
+                                              widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+        self.fields['to'] = forms.DateField(required=False, initial=today,
+                                            widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+        self.fields['granularity'] = forms.ChoiceField(choices=GRANULARITY_CHOICES, required=False, initial='day',
+                                                       widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for name in ('from', 'to', 'granularity'):
+            if not cleaned_data.get(name):
+                cleaned_data[name] = self.fields[name].initial
+        if cleaned_data['from'] > cleaned_data['to']:
+            raise forms.ValidationError("'from' must not be after 'to'.")
+        return cleaned_data
+
+
+
+class OrderExportForm(forms.Form):
+    """Format and optional date window (inclusive) of an order history export."""
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('parquet', 'Parquet')], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 'from' is a keyword, so the fields are declared here instead of on the class.
+        self.fields['from'] = forms.DateField(required=False)
+        self.fields['to'] = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        if cleaned_data.get('from') and cleaned_data.get('to') and cleaned_data['from'] > cleaned_data['to']:
+            raise forms.ValidationError("'from' must not be after 'to'.")
+        return cleaned_data
@@ -0,0 +1,144 @@
+import hashlib
+import mimetypes
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.shortcuts import reverse
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+KEY_PATTERN = re.compile(r'^img/[0-9a-f]{2}/[0-9a-f]{64}(-\d{2,4})?\.[a-z0-9]{1,5}$')
+
+
+def hashed_key(content, name):
+    """Content-addressed storage key, e.g. img/3f/3f2a...e1.jpg"""
+    digest = hashlib.sha256(content).hexdigest()
+    ext = os.path.splitext(name)[1].lower().lstrip('.') or 'bin'
+    return f"img/{digest[:2]}/{digest}.{ext}"
+
+
+def content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class LocalImageStore:
+    """Hashed images on the local filesystem, under root."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, key):
+        return self.root / key
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def save(self, key, content):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so a reader never sees a partial file
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+
+    def open(self, key):
+        """Binary file object for key, or None."""
+        try:
+            return self.path(key).open('rb')
+        except FileNotFoundError:
+            return None
+
+    def delete(self, keys):
+        for key in keys:
+            self.path(key).unlink(missing_ok=True)
+
+
+class S3ImageStore:
+    """Hashed images in the S3 bucket, uploaded with immutable cache headers."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, key):
+        return self.client.exists(key)
+
+    def save(self, key, content):
+        self.client.put_object(key, content, content_type(key), cache_control=IMMUTABLE_CACHE_CONTROL)
+
+    def open(self, key):
+        return self.client.open(key)
+
+    def delete(self, keys):
+        self.client.delete(keys)
+
+
+@lru_cache(maxsize=None)
+def get_image_store():
+    """The store for settings.IMAGE_BACKEND ('local' or 's3'), None when serving presigned urls."""
+    backend = settings.IMAGE_BACKEND
+    if backend == 'local':
+        return LocalImageStore(settings.IMAGE_ROOT)
+    if backend == 's3':
+        from .models import get_s3_client
+        return S3ImageStore(get_s3_client())
+    return None
+
+
+@receiver(setting_changed)
+def reset_image_store(setting, **kwargs):
+    if setting in ('IMAGE_BACKEND', 'IMAGE_ROOT'):
+        get_image_store.cache_clear()
+
+
+def read_upload(field_file):
+    """Bytes of an uploaded, not yet stored, file."""
+    field_file.open('rb')
+    field_file.seek(0)
+    content = field_file.read()
+    field_file.seek(0)
+    return content
+
+
+def store_image(content, name):
+    """Copy image bytes into the hashed store and return their key. Identical content is stored once."""
+    store = get_image_store()
+    if store is None:
+        return ''
+    key = hashed_key(content, name)
+    if not store.exists(key):
+        store.save(key, content)
+    return key
+
+
+def store_upload(content, name):
+    """
+    Store the bytes of a new upload, returns (key, stored); stored when the hashed object is the upload itself.
+    The s3 store is the bucket the image fields upload to, so there the upload is written once, under its key,
+    and without a HEAD first: identical bytes only rewrite the same object.
+    """
+    store = get_image_store()
+    if isinstance(store, S3ImageStore):
+        key = hashed_key(content, name)
+        store.save(key, content)
+        return key, True
+    return store_image(content, name), False
+
+
+def is_hashed_key(name):
+    """Whether a stored image name is a hashed key, an object identical uploads share."""
+    return bool(KEY_PATTERN.match(name or ''))
+
+
+def variant_key(key, width, ext):
+    """Key of a resized variant, next to the original: img/3f/3f2a...e1-320.webp"""
+    return f"{os.path.splitext(key)[0]}-{width}.{ext}"
+
+
+def image_url(key):
+    """Stable url of a hashed image, on the CDN when one is configured."""
+    if settings.IMAGE_CDN_URL:
+        return f"{settings.IMAGE_CDN_URL.rstrip('/')}/{key}"
+    return reverse('image-view', kwargs={'key': key})
@@ -0,0 +1,198 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+# most repeated query fingerprints kept per view for the stats endpoint
+TOP_DUPLICATES = 10
+
+_current = ContextVar('request_stats', default=None)
+_installed = False
+_install_lock = threading.Lock()
+
+
+@dataclass
+class RequestStats:
+    """What one request spent in SQL, template rendering and S3 calls."""
+    queries: int = 0
+    sql_ms: float = 0.0
+    render_ms: float = 0.0
+    s3_calls: int = 0
+    s3_ms: float = 0.0
+    total_ms: float = 0.0
+    fingerprints: Counter = field(default_factory=Counter)
+    render_depth: int = 0
+
+    def duplicates(self):
+        """{fingerprint: extra executions} of queries run more than once, usually an N+1."""
+        return {sql: count - 1 for sql, count in self.fingerprints.items() if count > 1}
+
+    def server_timing(self):
+        return ', '.join([
+            f'sql;dur={self.sql_ms:.1f};desc="{self.queries} queries"',
+            f'dup;desc="{sum(self.duplicates().values())} duplicated"',
+            f'tpl;dur={self.render_ms:.1f}',
+            f's3;dur={self.s3_ms:.1f};desc="{self.s3_calls} calls"',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+
+def start():
+    """Collect into a fresh RequestStats until stop(token)."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def fingerprint(sql):
+    """sql with literals and IN lists collapsed, so queries differing only in values match."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b|%s', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return ' '.join(sql.split())
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    """
+    Execute wrapper timing every query of the current request. It stays on the connection; the context
+    variable follows the request into the threads of sync_to_async, where async views run their queries.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_ms += (time.perf_counter() - start_time) * 1000
+        stats.queries += 1
+        stats.fingerprints[fingerprint(sql)] += 1
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        stats = _current.get()
+        # {% include %} renders nested templates within the outer one, time the outermost only
+        if stats is None or stats.render_depth:
+            return render(self, *args, **kwargs)
+        stats.render_depth += 1
+        start_time = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.render_ms += (time.perf_counter() - start_time) * 1000
+            stats.render_depth -= 1
+    return wrapper
+
+
+def _timed_s3(make_request):
+    def wrapper(self, *args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return make_request(self, *args, **kwargs)
+        start_time = time.perf_counter()
+        try:
+            return make_request(self, *args, **kwargs)
+        finally:
+            stats.s3_ms += (time.perf_counter() - start_time) * 1000
+            stats.s3_calls += 1
+    return wrapper
+
+
+def add_sql_wrapper(connection, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def install():
+    """
+    Time queries of every connection, template rendering and botocore requests (our S3 client and
+    django-storages alike). Installed once per process, and only when instrumentation is enabled.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        from botocore.endpoint import Endpoint
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.template.base import Template
+        connection_created.connect(add_sql_wrapper)
+        for connection in connections.all(initialized_only=True):
+            add_sql_wrapper(connection)
+        Template.render = _timed_render(Template.render)
+        Endpoint.make_request = _timed_s3(Endpoint.make_request)
+        _installed = True
+
+
+class Registry:
+    """Per view totals of this process since start."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, stats):
+        with self.lock:
+            totals = self.views.setdefault(view, {
+                'requests': 0, 'queries': 0, 'duplicate_queries': 0, 'sql_ms': 0.0,
+                'render_ms': 0.0, 's3_calls': 0, 's3_ms': 0.0, 'total_ms': 0.0, 'duplicates': Counter(),
+            })
+            duplicates = stats.duplicates()
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['duplicate_queries'] += sum(duplicates.values())
+            totals['sql_ms'] += stats.sql_ms
+            totals['render_ms'] += stats.render_ms
+            totals['s3_calls'] += stats.s3_calls
+            totals['s3_ms'] += stats.s3_ms
+            totals['total_ms'] += stats.total_ms
+            totals['duplicates'].update(duplicates)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: {**totals, 'duplicates': dict(totals['duplicates'].most_common(TOP_DUPLICATES))}
+                for view, totals in self.views.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+registry = Registry()
+
+PROMETHEUS_METRICS = [
+    # (metric, snapshot key, scale to the metric's unit, type, help)
+    ('shop_requests_total', 'requests', 1, 'counter', "Requests handled."),
+    ('shop_request_seconds_total', 'total_ms', 0.001, 'counter', "Time spent handling requests."),
+    ('shop_sql_queries_total', 'queries', 1, 'counter', "SQL queries run."),
+    ('shop_sql_duplicate_queries_total', 'duplicate_queries', 1, 'counter',
+     "SQL queries repeating an earlier query of the same request."),
+    ('shop_sql_seconds_total', 'sql_ms', 0.001, 'counter', "Time spent in SQL queries."),
+    ('shop_template_seconds_total', 'render_ms', 0.001, 'counter', "Time spent rendering templates."),
+    ('shop_s3_requests_total', 's3_calls', 1, 'counter', "Requests made to S3."),
+    ('shop_s3_seconds_total', 's3_ms', 0.001, 'counter', "Time spent in S3 requests."),
+]
+
+
+def label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshot):
+    """The snapshot in the Prometheus text exposition format, one series per view."""
+    lines = []
+    for metric, key, scale, kind, help_text in PROMETHEUS_METRICS:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for view, totals in sorted(snapshot.items()):
+            value = totals[key] * scale
+            lines.append(f'{metric}{{view="{label(view)}"}} {round(value, 6) if scale != 1 else value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,279 @@
+import json
+import random
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import Resolver404, resolve, reverse
+from .benchmarks import percentile
+from .models import MenuItem, Order, OrderItem, Table
+
+# mean pause between two steps of a waiter or kitchen screen, in seconds
+DEFAULT_THINK = 0.2
+ITEMS_PER_ORDER = (2, 5)
+DELIVERIES_PER_POLL = 3
+
+
+class DjangoClient:
+    """In-process client for the WSGI (django.test.Client) or ASGI (AsyncClient) handler."""
+
+    def __init__(self, asgi=False):
+        self.asgi = asgi
+        self.client = AsyncClient(raise_request_exception=False) if asgi else Client(raise_request_exception=False)
+
+    def request(self, method, path, data=None, htmx=True):
+        extra = {'HTTP_HX_REQUEST': 'true'} if htmx else {}
+        call = getattr(self.client, method.lower())
+        response = async_to_sync(call)(path, data or {}, **extra) if self.asgi else call(path, data or {}, **extra)
+        if response.streaming:
+            content = b''.join(response.streaming_content) if not self.asgi else b''
+        else:
+            content = response.content
+        return response.status_code, content
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpClient:
+    """Client for a running server, e.g. gunicorn on localhost. Keeps its own cookies (session, CSRF)."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        # the dashboard renders a {% csrf_token %}, which sets the cookie
+        self.request('GET', reverse('home-view'), htmx=False)
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, method, path, data=None, htmx=True):
+        headers = {'HX-Request': 'true'} if htmx else {}
+        body = None
+        if method == 'POST':
+            headers.update({'X-CSRFToken': self.csrf_token(), 'Referer': self.base_url + '/',
+                            'Content-Type': 'application/x-www-form-urlencoded'})
+            body = urlencode(data or {}).encode()
+        try:
+            with self.opener.open(Request(self.base_url + path, body, headers, method=method),
+                                  timeout=self.timeout) as response:
+                return response.status, response.read()
+        except HTTPError as error:
+            return error.code, error.read()
+        except (URLError, OSError):
+            # connection refused or reset, counted as an error
+            return 0, b''
+
+    def close(self):
+        pass
+
+
+def view_name(path):
+    try:
+        return resolve(urlsplit(path).path).url_name
+    except Resolver404:
+        return path
+
+
+class Recorder:
+    """Collects (view, status, latency ms) samples of all actors, and the request log for --record."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.samples = []
+        self.log = []
+
+    def issue(self, client, actor, method, path, data=None, htmx=True):
+        start = time.perf_counter()
+        status, content = client.request(method, path, data, htmx)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.samples.append((view_name(path), status, elapsed_ms))
+            self.log.append({'at': round(start - self.started, 4), 'actor': actor, 'method': method,
+                             'path': path, 'data': data or {}, 'htmx': htmx})
+        return status, content
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class Actor:
+    """One waiter tablet or kitchen screen, repeating its flow until the deadline."""
+
+    def __init__(self, name, client, recorder, deadline, think=DEFAULT_THINK, seed=None):
+        self.name = name
+        self.client = client
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time = think
+        self.rng = random.Random(seed)
+
+    def get(self, path, htmx=True):
+        return self.recorder.issue(self.client, self.name, 'GET', path, htmx=htmx)
+
+    def post(self, path, data=None):
+        return self.recorder.issue(self.client, self.name, 'POST', path, data)
+
+    def think(self):
+        if self.think_time:
+            time.sleep(self.rng.expovariate(1 / self.think_time))
+        return time.monotonic() < self.deadline
+
+    def run(self):
+        try:
+            while time.monotonic() < self.deadline:
+                self.flow()
+        finally:
+            self.client.close()
+
+
+class Waiter(Actor):
+    """Opens a free table, adds a few menu items, takes payment and finalizes the order."""
+
+    def __init__(self, *args, menu_items=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.menu_items = menu_items
+
+    def flow(self):
+        self.get(reverse('home-view'), htmx=False)
+        free = list(Table.objects.filter(in_use=False).values_list('id', 'section_id'))
+        if not free or not self.think():
+            # a full floor, wait for a table to be finalized
+            self.think()
+            return
+        table_id, section_id = self.rng.choice(free)
+        self.get(reverse('available-sections-view'))
+        self.get(reverse('available-tables-view', args=[section_id]))
+        status, _ = self.post(reverse('activate-table-order-view', args=[table_id]))
+        if status != 200:
+            # another waiter got the table first
+            return
+        order_id = Order.objects.filter(table_id=table_id, is_finished=False).order_by('-id').values_list(
+            'id', flat=True).first()
+        if order_id is None or not self.think():
+            return
+        self.get(reverse('order-detail-view', args=[order_id]), htmx=False)
+        for _ in range(self.rng.randint(*ITEMS_PER_ORDER)):
+            if not self.think():
+                break
+            menu_item_id, category_handle = self.rng.choice(self.menu_items)
+            self.get(reverse('menu-item-list-view', args=[category_handle]))
+            self.get(reverse('order-item-create-view', args=[menu_item_id]))
+            self.post(f"{reverse('order-item-create-view', args=[menu_item_id])}?quantity={self.rng.randint(1, 3)}")
+        self.get(reverse('partial-order-items-list-view'))
+        self.think()
+        self.post(reverse('paid-order-view'))
+        self.post(reverse('finalize-order-view', args=[order_id]))
+
+
+class KitchenScreen(Actor):
+    """Polls the undelivered items and delivers a few of them."""
+
+    def flow(self):
+        self.get(reverse('undelivered-items-view'))
+        items = list(OrderItem.objects.filter(order__is_finished=False, is_delivered=False)
+                     .values_list('id', 'order_id')[:50])
+        for item_id, order_id in self.rng.sample(items, min(DELIVERIES_PER_POLL, len(items))):
+            if not self.think():
+                return
+            # deliveries act on the order of the session, as on the order page
+            self.get(reverse('order-detail-view', args=[order_id]), htmx=False)
+            self.post(reverse('deliver-order-item-view', args=[item_id]))
+        self.think()
+
+
+def run_actors(actors):
+    threads = [threading.Thread(target=actor.run, name=actor.name) for actor in actors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_synthetic(make_client, waiters=4, kitchens=1, duration=30.0, think=DEFAULT_THINK, seed=1):
+    """Simulate waiters and kitchen screens for duration seconds, each with its own client. Returns the Recorder."""
+    menu_items = list(MenuItem.objects.values_list('id', 'category__handle'))
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    actors = [
+        Waiter(f'waiter-{n}', make_client(), recorder, deadline, think, seed=seed + n, menu_items=menu_items)
+        for n in range(waiters)
+    ] + [
+        KitchenScreen(f'kitchen-{n}', make_client(), recorder, deadline, think, seed=seed + waiters + n)
+        for n in range(kitchens)
+    ]
+    run_actors(actors)
+    return recorder
+
+
+class Replayer(Actor):
+    """Issues the logged requests of one actor, keeping their original spacing divided by speed."""
+
+    def __init__(self, name, client, recorder, entries, speed=1.0):
+        super().__init__(name, client, recorder, deadline=None, think=0)
+        self.entries = entries
+        self.speed = speed
+
+    def run(self):
+        try:
+            for entry in self.entries:
+                if self.speed:
+                    delay = entry['at'] / self.speed - self.recorder.elapsed()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.recorder.issue(self.client, self.name, entry['method'], entry['path'],
+                                    entry.get('data'), entry.get('htmx', True))
+        finally:
+            self.client.close()
+
+
+def read_log(stream):
+    return [json.loads(line) for line in stream if line.strip()]
+
+
+def write_log(stream, log):
+    for entry in sorted(log, key=lambda entry: entry['at']):
+        stream.write(json.dumps(entry) + '\n')
+
+
+def replay(make_client, entries, speed=1.0):
+    """Replay a request log, one client per logged actor. speed=0 sends as fast as possible. Returns the Recorder."""
+    by_actor = {}
+    for entry in sorted(entries, key=lambda entry: entry['at']):
+        by_actor.setdefault(entry['actor'], []).append(entry)
+    recorder = Recorder()
+    run_actors([Replayer(actor, make_client(), recorder, actor_entries, speed)
+                for actor, actor_entries in by_actor.items()])
+    return recorder
+
+
+def summarize(samples, elapsed):
+    """Per view: requests, errors (5xx or no response), throughput (req/s) and p50/p95/p99/max latency (ms)."""
+    by_view = {}
+    for name, status, latency in samples:
+        by_view.setdefault(name, []).append((status, latency))
+    by_view['total'] = [(status, latency) for _, status, latency in samples]
+    rows = {}
+    for name, results in by_view.items():
+        latencies = [latency for _, latency in results]
+        rows[name] = {
+            'requests': len(results),
+            'errors': sum(1 for status, _ in results if status == 0 or status >= 500),
+            'rps': round(len(results) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.5), 2) if latencies else 0.0,
+            'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else 0.0,
+            'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else 0.0,
+            'max_ms': round(max(latencies), 2) if latencies else 0.0,
+        }
+    return rows
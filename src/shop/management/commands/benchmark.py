@@ -0,0 +1,63 @@
+import logging
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from shop import benchmarks
+from shop.urls import urlpatterns
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with a realistic dataset, request every shop route and "
+        "report query counts, p50/p99 latency and bytes. Fails when a route runs more queries than its baseline "
+        "or answers another status code. Latency is machine dependent and only reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against / write.")
+        parser.add_argument('--write-baseline', action='store_true', help="Record this run as the new baseline.")
+        parser.add_argument('--iterations', type=int, default=20, help="Measured requests per route.")
+        parser.add_argument('--days', type=int, help="Days of order history to seed.")
+        parser.add_argument('--orders-per-day', type=int, help="Orders seeded per day.")
+        parser.add_argument('--tolerance', type=float, default=benchmarks.DEFAULT_TOLERANCE,
+                            help="Relative p50 growth over the baseline reported as a warning.")
+
+    def handle(self, *args, **options):
+        scale = {key: options[key] for key in ('days', 'orders_per_day') if options[key] is not None}
+        setup_test_environment()
+        # 403/404 routes are expected, keep their tracebacks out of the report
+        request_logger = logging.getLogger('django.request')
+        request_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            scale = benchmarks.seed(scale)
+            results = benchmarks.run(urlpatterns, iterations=options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            request_logger.setLevel(request_level)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'route':<60} {'status':>6} {'queries':>7} {'p50 ms':>8} {'p99 ms':>8} {'bytes':>8}")
+        for name, metrics in results.items():
+            self.stdout.write(
+                f"{name:<60} {metrics['status']:>6} {metrics['queries']:>7} "
+                f"{metrics['p50_ms']:>8} {metrics['p99_ms']:>8} {metrics['bytes']:>8}"
+            )
+
+        if options['write_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            benchmarks.write_baseline(options['baseline'], results, scale, options['iterations'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote baseline to {options['baseline']}."))
+            return
+        baseline = benchmarks.load_baseline(options['baseline']) if os.path.exists(options['baseline']) else {}
+        for warning in benchmarks.slower(results, baseline, options['tolerance']):
+            self.stderr.write(f"Slower than the baseline machine: {warning}")
+        regressions = benchmarks.compare(results, baseline)
+        if regressions:
+            raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} routes within budget."))
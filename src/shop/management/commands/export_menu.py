@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from shop.menu_io import export_records, write_records
+
+
+class Command(BaseCommand):
+    help = "Export sections, tables, menu categories and items as CSV or JSON Lines (- for stdout)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write, - writes stdout.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        if path == '-':
+            write_records(export_records(), self.stdout, fmt)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as stream:
+            count = write_records(export_records(), stream, fmt)
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} records to {path}."))
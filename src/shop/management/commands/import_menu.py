@@ -0,0 +1,37 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from shop.menu_io import IMPORT_BATCH_SIZE, MenuImporter, MenuImportError, read_records
+
+
+class Command(BaseCommand):
+    help = "Import sections, tables, menu categories and items from a CSV or JSON Lines file (- for stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, - reads stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--images-dir', help="Directory image paths are relative to, defaults to the file's directory.")
+        parser.add_argument('--replace-images', action='store_true', help="Upload images for rows that already have one.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Records written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        images_dir = options['images_dir'] or (os.path.dirname(os.path.abspath(path)) if path != '-' else '.')
+        importer = MenuImporter(
+            images_dir=images_dir,
+            replace_images=options['replace_images'],
+            batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        try:
+            if path == '-':
+                counts = importer.run(read_records(sys.stdin, fmt))
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    counts = importer.run(read_records(stream, fmt))
+        except (OSError, ValueError, MenuImportError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported menu: {counts['created']} created, {counts['updated']} updated, {counts['images']} images uploaded."
+        ))
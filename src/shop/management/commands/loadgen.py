@@ -0,0 +1,81 @@
+import logging
+from functools import partial
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from shop import benchmarks, loadgen
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent waiters and kitchen screens, or replay a recorded JSONL request log, and report "
+        "throughput and tail latency per view. --url targets a running server (it must share this project's "
+        "database settings, ids are looked up there), otherwise the WSGI or ASGI handler runs in-process "
+        "against a throwaway seeded database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://localhost:8000.")
+        parser.add_argument('--asgi', action='store_true', help="In-process: use the ASGI handler instead of WSGI.")
+        parser.add_argument('--waiters', type=int, default=4, help="Concurrent waiter tablets.")
+        parser.add_argument('--kitchens', type=int, default=1, help="Concurrent kitchen screens.")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run the synthetic workload.")
+        parser.add_argument('--think', type=float, default=loadgen.DEFAULT_THINK,
+                            help="Mean pause between steps in seconds, 0 for none.")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed of the workload.")
+        parser.add_argument('--record', help="Write the issued requests to this JSONL log.")
+        parser.add_argument('--replay', help="Replay this JSONL log instead of the synthetic workload.")
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help="Replay speed-up, 0 sends every actor's requests back to back.")
+        parser.add_argument('--days', type=int, default=7, help="In-process: days of order history to seed.")
+
+    def handle(self, *args, **options):
+        if options['url']:
+            make_client = partial(loadgen.HttpClient, options['url'])
+            recorder = self.run_workload(make_client, options)
+        else:
+            make_client = partial(loadgen.DjangoClient, asgi=options['asgi'])
+            setup_test_environment()
+            # errors are counted in the report, keep their tracebacks out of it
+            request_logger = logging.getLogger('django.request')
+            request_level = request_logger.level
+            request_logger.setLevel(logging.CRITICAL)
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                benchmarks.seed({'days': options['days']}, seed=options['seed'])
+                recorder = self.run_workload(make_client, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                request_logger.setLevel(request_level)
+                teardown_test_environment()
+
+        if options['record']:
+            with open(options['record'], 'w') as f:
+                loadgen.write_log(f, recorder.log)
+            self.stdout.write(f"Recorded {len(recorder.log)} requests to {options['record']}.")
+
+        elapsed = recorder.elapsed()
+        rows = loadgen.summarize(recorder.samples, elapsed)
+        self.stdout.write(f"{len(recorder.samples)} requests in {elapsed:.1f}s")
+        self.stdout.write(
+            f"{'view':<40} {'requests':>8} {'errors':>6} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for name, row in sorted(rows.items(), key=lambda item: (item[0] == 'total', item[0])):
+            self.stdout.write(
+                f"{name:<40} {row['requests']:>8} {row['errors']:>6} {row['rps']:>8} "
+                f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {row['max_ms']:>8}"
+            )
+
+    def run_workload(self, make_client, options):
+        if connection.vendor == 'sqlite':
+            self.stderr.write("SQLite serializes writers, concurrent clients will see 'database is locked' errors.")
+        if options['replay']:
+            try:
+                with open(options['replay']) as f:
+                    entries = loadgen.read_log(f)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read {options['replay']}: {error}")
+            return loadgen.replay(make_client, entries, options['speed'])
+        return loadgen.run_synthetic(make_client, options['waiters'], options['kitchens'], options['duration'],
+                                     options['think'], options['seed'])
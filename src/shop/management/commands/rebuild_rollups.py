@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollups used by the charts from the finalized order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Orders folded in per batch.")
+
+    def handle(self, *args, **options):
+        processed = rebuild_rollups(chunk_size=options['chunk_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups from {processed} finalized orders."))
@@ -0,0 +1,181 @@
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+SHARED_VERSION_KEY = 'menu:version'
+SHARED_MENU_KEY = 'menu:tree:{}'
+
+_lock = threading.Lock()
+_menu = None
+_version = uuid.uuid4().hex
+
+
+@dataclass(frozen=True)
+class CachedProduct:
+    """The product fields the menu pages show. get_image_url / get_image_sources mirror Product's."""
+    id: int
+    name: str
+    size: str
+    unit: str
+    handle: str
+    description: str
+    image: str
+    image_url: str = None
+    image_sources: dict = field(default_factory=dict)
+
+    def get_image_url(self):
+        return self.image_url
+
+    def get_image_sources(self):
+        return self.image_sources
+
+
+@dataclass(frozen=True)
+class CachedMenuItem:
+    id: int
+    handle: str
+    price: Decimal
+    product: CachedProduct
+
+
+@dataclass(frozen=True)
+class CachedCategory:
+    """A category with its active menu items."""
+    id: int
+    name: str
+    handle: str
+    description: str
+    image: str
+    image_url: str = None
+    image_sources: dict = field(default_factory=dict)
+    items: tuple = ()
+
+    def get_image_url(self):
+        return self.image_url
+
+    def get_image_sources(self):
+        return self.image_sources
+
+
+@dataclass
+class Menu:
+    """Immutable snapshot of the whole menu, swapped in whole, so readers never see a half built one."""
+    version: str
+    built: float
+    max_age: float
+    categories: tuple
+    by_handle: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.by_handle = {category.handle: category for category in self.categories}
+
+    def is_fresh(self):
+        return time.time() - self.built < self.max_age
+
+    def category(self, handle):
+        return self.by_handle.get(handle)
+
+
+def shared_cache():
+    """The cache of settings.MENU_CACHE_ALIAS, shared by all workers, or None."""
+    alias = settings.MENU_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def max_age():
+    from .images import get_image_store
+    from .models import get_s3_client
+    # without a shared cache, other workers' writes only show once the snapshot expires
+    age = float('inf') if settings.MENU_CACHE_ALIAS else settings.MENU_CACHE_SECONDS
+    if get_image_store() is None:
+        # S3Client hands out cached presigned urls with at least url_expiry_margin seconds left
+        age = min(age, get_s3_client().url_expiry_margin)
+    return age
+
+
+def build_menu(version):
+    """Categories, active items, products, prices and image urls in two queries."""
+    from .models import MenuCategory, MenuItem
+
+    # the snapshot's age counts from before the first url is signed
+    built = time.time()
+    items = {}
+    for item in MenuItem.objects.filter(is_active=True, category__isnull=False).select_related('product').order_by('id'):
+        product = item.product
+        items.setdefault(item.category_id, []).append(CachedMenuItem(
+            id=item.id, handle=item.handle, price=item.price,
+            product=CachedProduct(
+                id=product.id, name=product.name, size=product.size, unit=product.unit, handle=product.handle,
+                description=product.description, image=product.image.name or '',
+                image_url=product.get_image_url(), image_sources=product.get_image_sources(),
+            ),
+        ))
+    categories = tuple(
+        CachedCategory(
+            id=category.id, name=category.name, handle=category.handle, description=category.description,
+            image=category.image.name or '', image_url=category.get_image_url(),
+            image_sources=category.get_image_sources(), items=tuple(items.get(category.id, ())),
+        )
+        for category in MenuCategory.objects.order_by('id')
+    )
+    return Menu(version=version, built=built, max_age=max_age(), categories=categories)
+
+
+def current_version():
+    shared = shared_cache()
+    if shared is None:
+        return _version
+    version = shared.get(SHARED_VERSION_KEY)
+    if version is None:
+        shared.add(SHARED_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = shared.get(SHARED_VERSION_KEY)
+    return version
+
+
+def load_menu(version):
+    """The shared snapshot of version, else a fresh one from the database, published for the other workers."""
+    shared = shared_cache()
+    if shared is not None:
+        menu = shared.get(SHARED_MENU_KEY.format(version))
+        if menu is not None and menu.is_fresh():
+            return menu
+    menu = build_menu(version)
+    if shared is not None:
+        shared.set(SHARED_MENU_KEY.format(version), menu, timeout=None if menu.max_age == float('inf') else menu.max_age)
+    return menu
+
+
+def get_menu():
+    """The current menu. No queries while it is up to date, one rebuild per change otherwise."""
+    global _menu
+    version = current_version()
+    menu = _menu
+    if menu is not None and menu.version == version and menu.is_fresh():
+        return menu
+    with _lock:
+        menu = _menu
+        if menu is None or menu.version != version or not menu.is_fresh():
+            menu = _menu = load_menu(version)
+    return menu
+
+
+def bump_version():
+    global _version
+    _version = uuid.uuid4().hex
+    shared = shared_cache()
+    if shared is not None:
+        shared.set(SHARED_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_menu():
+    """
+    Outdate the cached menu after a product, menu item or category write: right away, and again once
+    the transaction commits, so a snapshot read before the commit is not kept.
+    """
+    bump_version()
+    transaction.on_commit(bump_version)
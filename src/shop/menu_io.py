@@ -0,0 +1,288 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils.text import slugify
+from .images import store_upload
+from .menu_cache import invalidate_menu
+from .models import (Product, MenuCategory, MenuItem, Section, Table, VersionedModel, loaded_image, replaced_image,
+                     product_image_upload_path, category_image_upload_path)
+from .thumbnails import schedule_thumbnails, schedule_variant_cleanup
+
+# One record per row, the type column says what it describes. An item is a product,
+# plus its menu entry when it has a price.
+RECORD_TYPES = ('section', 'category', 'table', 'item')
+COLUMNS = ('type', 'name', 'size', 'unit', 'description', 'category', 'price', 'is_active', 'section', 'image')
+IMPORT_BATCH_SIZE = 1000
+UPLOAD_WORKERS = 8
+
+
+class MenuImportError(Exception):
+    pass
+
+
+def read_records(stream, fmt):
+    """Yield records from a CSV or JSON Lines stream, without loading it whole."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def export_records():
+    """Yield every section, category, table and product as import records."""
+    for section in Section.objects.order_by('id').iterator():
+        yield {'type': 'section', 'name': section.name, 'description': section.notes or ''}
+    for category in MenuCategory.objects.order_by('id').iterator():
+        yield {'type': 'category', 'name': category.name, 'description': category.description or '',
+               'image': category.image.name or ''}
+    for table in Table.objects.select_related('section').order_by('id').iterator():
+        yield {'type': 'table', 'name': table.name, 'description': table.description or '',
+               'section': table.section.name if table.section else ''}
+    products = Product.objects.select_related('menuitem__category').order_by('id')
+    for product in products.iterator(chunk_size=2000):
+        record = {'type': 'item', 'name': product.name, 'size': product.size, 'unit': product.unit,
+                  'description': product.description or '', 'image': product.image.name or ''}
+        menu_item = getattr(product, 'menuitem', None)
+        if menu_item is not None:
+            record.update({
+                'category': menu_item.category.name if menu_item.category else '',
+                'price': str(menu_item.price),
+                'is_active': menu_item.is_active,
+            })
+        yield record
+
+
+def write_records(records, stream, fmt):
+    """Write records as CSV or JSON Lines, one at a time. Returns the count."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for count, record in enumerate(records, 1):
+            writer.writerow(record)
+    else:
+        for count, record in enumerate(records, 1):
+            stream.write(json.dumps(record) + '\n')
+    return count
+
+
+def parse_bool(value, default=True):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class MenuImporter:
+    """
+    Upserts import records batch by batch. Each batch reads what already exists,
+    uploads its images in parallel, then writes with a handful of
+    bulk_create/bulk_update statements per model inside one transaction.
+
+    importer = MenuImporter(images_dir='exports/')
+    importer.run(read_records(stream, 'csv'))
+    """
+
+    def __init__(self, images_dir='.', replace_images=False, batch_size=IMPORT_BATCH_SIZE, stdout=None):
+        self.images_dir = images_dir
+        self.replace_images = replace_images
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.sections = {section.name: section for section in Section.objects.all()}
+        self.categories = {category.name: category for category in MenuCategory.objects.all()}
+        self.counts = {'created': 0, 'updated': 0, 'images': 0}
+
+    def run(self, records):
+        batch = []
+        for number, record in enumerate(records, 1):
+            if record.get('type') not in RECORD_TYPES:
+                raise MenuImportError(f"Record {number}: unknown type {record.get('type')!r}.")
+            if not record.get('name'):
+                raise MenuImportError(f"Record {number}: name is required.")
+            batch.append((number, record))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        return self.counts
+
+    def import_batch(self, batch):
+        by_type = {record_type: [] for record_type in RECORD_TYPES}
+        for number, record in batch:
+            by_type[record['type']].append((number, record))
+
+        sections = self.prepare_sections(by_type['section'])
+        categories, category_images = self.prepare_categories(by_type['category'])
+        tables = self.prepare_tables(by_type['table'])
+        products, menu_items, product_images = self.prepare_items(by_type['item'])
+        uploads = self.upload_images(category_images, category_image_upload_path)
+        uploads += self.upload_images(product_images, product_image_upload_path)
+
+        image_fields = ['image', 'image_key', 'image_widths']
+        with transaction.atomic():
+            self.upsert(Section, sections, ['notes'])
+            self.upsert(MenuCategory, categories, ['handle', 'description', *image_fields])
+            self.upsert(Table, tables, ['description'])
+            self.upsert(Product, products, ['handle', 'description', *image_fields])
+            self.upsert(MenuItem, menu_items, ['handle', 'category', 'price', 'is_active'])
+            for instance, content in uploads:
+                schedule_thumbnails(instance, content)
+            for instance in (*categories, *products):
+                replaced = replaced_image(instance)
+                if replaced is not None:
+                    schedule_variant_cleanup(replaced)
+                instance._loaded_image = loaded_image(instance)
+            # bulk writes send no signals
+            invalidate_menu()
+
+        if self.stdout is not None:
+            self.stdout.write(f"{self.counts['created']} created, {self.counts['updated']} updated")
+
+    def upsert(self, model, objects, fields):
+        """bulk_create the new objects, bulk_update the ones already stored."""
+        new = [obj for obj in objects if obj.pk is None]
+        old = [obj for obj in objects if obj.pk is not None]
+        model.objects.bulk_create(new, batch_size=self.batch_size)
+        if old:
+            if issubclass(model, VersionedModel):
+                # bulk_update bypasses save(), bump the versions the ETags are built from here
+                for obj in old:
+                    obj.version = F('version') + 1
+                fields = [*fields, 'version']
+            model.objects.bulk_update(old, fields, batch_size=self.batch_size)
+        self.counts['created'] += len(new)
+        self.counts['updated'] += len(old)
+
+    def prepare_sections(self, rows):
+        sections = {}
+        for _, record in rows:
+            section = self.sections.get(record['name']) or Section(name=record['name'])
+            section.notes = record.get('description') or None
+            sections[section.name] = section
+        self.sections.update(sections)
+        return list(sections.values())
+
+    def prepare_categories(self, rows):
+        categories = {}
+        for _, record in rows:
+            category = self.categories.get(record['name']) or MenuCategory(name=record['name'])
+            category.handle = category.handle or slugify(category.name)
+            category.description = record.get('description') or None
+            categories[category.name] = (category, record.get('image'))
+        self.categories.update({name: category for name, (category, _) in categories.items()})
+        return [category for category, _ in categories.values()], list(categories.values())
+
+    def prepare_tables(self, rows):
+        records = {}
+        for number, record in rows:
+            section = self.section_for(number, record)
+            records[(record['name'], section.name if section else None)] = (section, record)
+        if not records:
+            return []
+        existing = {
+            (table.name, table.section.name if table.section else None): table
+            for table in Table.objects.filter(name__in={name for name, _ in records}).select_related('section')
+        }
+        tables = []
+        for key, (section, record) in records.items():
+            table = existing.get(key) or Table(name=key[0], section=section)
+            table.description = record.get('description') or None
+            tables.append(table)
+        return tables
+
+    def prepare_items(self, rows):
+        records = {}
+        for number, record in rows:
+            size, unit = record.get('size') or '', record.get('unit') or 'draft'
+            records[(record['name'], unit, size)] = (number, record)
+        if not records:
+            return [], [], []
+        existing = {
+            (product.name, product.unit, product.size): product
+            for product in Product.objects.filter(name__in={name for name, _, _ in records}).select_related('menuitem')
+        }
+
+        products, menu_items, images = [], [], []
+        for key, (number, record) in records.items():
+            name, unit, size = key
+            product = existing.get(key) or Product(name=name, unit=unit, size=size)
+            product.handle = product.handle or slugify('-'.join([name, size, unit]))
+            product.description = record.get('description') or None
+            products.append(product)
+            images.append((product, record.get('image')))
+            if record.get('price') in (None, ''):
+                continue
+            try:
+                price = Decimal(str(record['price']))
+            except InvalidOperation:
+                raise MenuImportError(f"Record {number}: invalid price {record['price']!r}.")
+            menu_item = (getattr(product, 'menuitem', None) if product.pk else None) or MenuItem(product=product)
+            menu_item.handle = menu_item.handle or product.handle
+            menu_item.category = self.category_for(number, record)
+            menu_item.price = price
+            menu_item.is_active = parse_bool(record.get('is_active'))
+            menu_items.append(menu_item)
+        return products, menu_items, images
+
+    def section_for(self, number, record):
+        name = record.get('section')
+        if not name:
+            return None
+        if name not in self.sections:
+            raise MenuImportError(f"Record {number}: unknown section {name!r}.")
+        return self.sections[name]
+
+    def category_for(self, number, record):
+        name = record.get('category')
+        if not name:
+            return None
+        if name not in self.categories:
+            raise MenuImportError(f"Record {number}: unknown category {name!r}.")
+        return self.categories[name]
+
+    def upload_images(self, pairs, upload_path):
+        """
+        Upload the images of (instance, image) pairs concurrently, returns (instance, content) per upload.
+        An image naming a local file is uploaded, anything else is taken as an already stored name.
+        """
+        uploads = []
+        for instance, image in pairs:
+            if not image or (instance.image and not self.replace_images):
+                continue
+            path = image if os.path.isabs(image) else os.path.join(self.images_dir, image)
+            if os.path.isfile(path):
+                uploads.append((instance, path))
+            elif instance.image.name != image:
+                instance.image = image
+                instance.image_key = ''
+                instance.image_widths = []
+
+        def upload(args):
+            instance, path = args
+            with open(path, 'rb') as f:
+                content = f.read()
+            filename = os.path.basename(path)
+            key, stored = store_upload(content, filename)
+            name = key if stored else default_storage.save(upload_path(instance, filename), ContentFile(content))
+            return instance, name, key, content
+
+        if not uploads:
+            return []
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            results = list(executor.map(upload, uploads))
+        for instance, name, key, _ in results:
+            instance.image = name
+            instance.image_key = key
+            instance.image_widths = []
+        self.counts['images'] += len(results)
+        return [(instance, content) for instance, _, _, content in results]
@@ -1,17 +1,126 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import SimpleLazyObject
+from whitenoise.middleware import WhiteNoiseMiddleware
+from shop import instrumentation
 from shop.models import Order
 
-class OrderMiddleware:
-    """Middleware to get the order object from the last visited order-detail-view. Populates request.order"""
+
+def get_session_order(request):
+    """Order of the last visited order-detail-view, or None."""
+    order_id = request.session.get('order_id')
+    if not order_id:
+        return None
+    return Order.objects.select_related('table__section').filter(id=order_id).first()
+
+
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that runs natively in both modes. Unlike MiddlewareMixin, the hooks are called
+    directly, so they must not block: an async request under ASGI does not hop to a thread for them.
+    process_request() returns state that is passed on to process_response().
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.process_request(request)
+        return self.process_response(request, self.get_response(request), state)
+
+    async def __acall__(self, request):
+        state = self.process_request(request)
+        return self.process_response(request, await self.get_response(request), state)
+
+    def process_request(self, request):
+        return None
+
+    def process_response(self, request, response, state):
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, also async capable. Near the top of the stack, a sync-only WhiteNoise would hold
+    a thread for every ASGI request; here only static files are served from a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class OrderMiddleware(AsyncCapableMiddleware):
+    """
+    Middleware to get the order object from the last visited order-detail-view. Populates request.order
+    lazily: the session and the order are only loaded on first access, then cached for the request.
+    Async views must not touch request.order, the lazy load is a sync query.
+    """
+    def process_request(self, request):
+        request.order = SimpleLazyObject(lambda: get_session_order(request))
+
+
+class InstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Records query count, SQL time, duplicated queries, template render time and S3 time per request,
+    sends them as a Server-Timing header and adds them to the per view totals of instrumentation.registry.
+    Removed from the stack unless settings.INSTRUMENTATION is on.
+    """
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        instrumentation.install()
+        super().__init__(get_response)
+
     def __call__(self, request):
-        order_id = request.session.get('order_id')
-        if order_id:
-            try:
-                order = Order.objects.get(id=order_id)
-                order_obj = order
-            except Order.DoesNotExist:
-                order_obj = None
-            request.order = order_obj
-        return self.get_response(request)
\ No newline at end of file
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = instrumentation.start()
+        try:
+            start = time.perf_counter()
+            response = self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        return self.process_response(request, response, (stats, start))
+
+    async def __acall__(self, request):
+        stats, token = instrumentation.start()
+        try:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        return self.process_response(request, response, (stats, start))
+
+    def process_response(self, request, response, state):
+        stats, start = state
+        stats.total_ms = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        instrumentation.registry.record(match.view_name if match else 'unresolved', stats)
+        response['Server-Timing'] = stats.server_timing()
+        return response
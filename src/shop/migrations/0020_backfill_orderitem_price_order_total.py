@@ -0,0 +1,57 @@
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def backfill_prices_and_totals(apps, schema_editor):
+    """Snapshot the current menu price on historical order items and store each order's total, in batches."""
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Order = apps.get_model('shop', 'Order')
+
+    last_id = 0
+    while True:
+        batch = list(
+            OrderItem.objects.filter(id__gt=last_id, price__isnull=True)
+            .order_by('id')
+            .select_related('menu_item')
+            .only('id', 'menu_item__price')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for item in batch:
+            item.price = item.menu_item.price
+        OrderItem.objects.bulk_update(batch, ['price'])
+        last_id = batch[-1].id
+
+    last_id = 0
+    while True:
+        totals = list(
+            Order.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .annotate(bill_total=Coalesce(
+                Sum(F('orderitem__price') * F('orderitem__quantity')),
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ))
+            .values_list('id', 'bill_total')[:BATCH_SIZE]
+        )
+        if not totals:
+            break
+        Order.objects.bulk_update(
+            [Order(id=order_id, total=total) for order_id, total in totals], ['total']
+        )
+        last_id = totals[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_orderitem_price_order_total'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_prices_and_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menucategory',
+            name='image_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0025_image_widths'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created', 'id'], name='order_created_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_created_idx',
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+POSTGRES_FORWARDS = [
+    # icontains compiles to UPPER(name::text) LIKE UPPER(...), trigram_word_similar to name %> ...
+    "CREATE INDEX IF NOT EXISTS product_name_upper_trgm_idx ON shop_product USING gin ((UPPER(name::text)) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON shop_product USING gin (name gin_trgm_ops)",
+]
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS product_name_upper_trgm_idx",
+    "DROP INDEX IF EXISTS product_name_trgm_idx",
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+    "name, size, unit, description, content='shop_product', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_insert AFTER INSERT ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(rowid, name, size, unit, description) "
+    "VALUES (new.id, new.name, new.size, new.unit, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_delete AFTER DELETE ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, size, unit, description) "
+    "VALUES ('delete', old.id, old.name, old.size, old.unit, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_update AFTER UPDATE ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, size, unit, description) "
+    "VALUES ('delete', old.id, old.name, old.size, old.unit, old.description); "
+    "INSERT INTO shop_product_fts(rowid, name, size, unit, description) "
+    "VALUES (new.id, new.name, new.size, new.unit, new.description); END",
+    "INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+    "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+    "DROP TRIGGER IF EXISTS shop_product_fts_update",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    """Text search indexes: pg_trgm GIN indexes on Postgres, an FTS5 table on SQLite."""
+
+    dependencies = [
+        ('shop', '0026_order_created_id_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARDS, 'sqlite': SQLITE_FORWARDS}),
+            run({'postgresql': POSTGRES_BACKWARDS, 'sqlite': SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def merge_uncategorized_rows(apps, schema_editor):
+    """Fold the one-row-per-finalize uncategorized rollups into a single row per day."""
+    DailyCategorySales = apps.get_model('shop', 'DailyCategorySales')
+    uncategorized = DailyCategorySales.objects.filter(category__isnull=True)
+    totals = list(uncategorized.order_by().values('date').annotate(total_quantity=Sum('quantity'),
+                                                                   total_revenue=Sum('revenue')))
+    uncategorized.delete()
+    DailyCategorySales.objects.bulk_create([
+        DailyCategorySales(date=row['date'], category=None, quantity=row['total_quantity'],
+                           revenue=row['total_revenue'])
+        for row in totals
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0027_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_uncategorized_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('date',), name='unique_daily_uncategorized_sales'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:40
+
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    """Roll up the orders finalized before the rollup tables existed, the charts read nothing else."""
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    DailyMenuItemSales = apps.get_model('shop', 'DailyMenuItemSales')
+    DailyCategorySales = apps.get_model('shop', 'DailyCategorySales')
+    HourlyOrderSales = apps.get_model('shop', 'HourlyOrderSales')
+    for model in (DailyMenuItemSales, DailyCategorySales, HourlyOrderSales):
+        model.objects.all().delete()
+
+    items = OrderItem.objects.filter(order__is_finished=True).annotate(date=TruncDate('created')).order_by()
+    sums = {'total_quantity': Sum('quantity'), 'total_revenue': Sum(F('price') * F('quantity'))}
+    DailyMenuItemSales.objects.bulk_create([
+        DailyMenuItemSales(date=row['date'], menu_item_id=row['menu_item_id'], quantity=row['total_quantity'],
+                           revenue=row['total_revenue'])
+        for row in items.values('date', 'menu_item_id').annotate(**sums)
+    ], batch_size=500)
+    DailyCategorySales.objects.bulk_create([
+        DailyCategorySales(date=row['date'], category_id=row['menu_item__category_id'],
+                           quantity=row['total_quantity'], revenue=row['total_revenue'])
+        for row in items.values('date', 'menu_item__category_id').annotate(**sums)
+    ], batch_size=500)
+    orders = Order.objects.filter(is_finished=True).annotate(date=TruncDate('created'), hour=ExtractHour('created'))
+    HourlyOrderSales.objects.bulk_create([
+        HourlyOrderSales(date=row['date'], hour=row['hour'], orders=row['total_orders'],
+                         revenue=row['total_revenue'])
+        for row in orders.order_by().values('date', 'hour').annotate(total_orders=Count('id'),
+                                                                     total_revenue=Sum('total'))
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0028_daily_uncategorized_sales'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# shop.search.ProductDocument, as Django compiles it: icontains wraps it in UPPER(...::text), %> uses it as is
+DOCUMENT = "(name || ' ' || size || ' ' || unit || ' ' || COALESCE(description, ''))"
+POSTGRES_FORWARDS = [
+    f"CREATE INDEX IF NOT EXISTS product_document_upper_trgm_idx ON shop_product USING gin ((UPPER({DOCUMENT}::text)) gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS product_document_trgm_idx ON shop_product USING gin ({DOCUMENT} gin_trgm_ops)",
+    # the name-only indexes of 0027 no longer serve any query
+    "DROP INDEX IF EXISTS product_name_upper_trgm_idx",
+    "DROP INDEX IF EXISTS product_name_trgm_idx",
+]
+POSTGRES_BACKWARDS = [
+    "CREATE INDEX IF NOT EXISTS product_name_upper_trgm_idx ON shop_product USING gin ((UPPER(name::text)) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON shop_product USING gin (name gin_trgm_ops)",
+    "DROP INDEX IF EXISTS product_document_upper_trgm_idx",
+    "DROP INDEX IF EXISTS product_document_trgm_idx",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+    """Trigram indexes over name, size, unit and description for the Postgres product search."""
+
+    dependencies = [
+        ('shop', '0029_backfill_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'postgresql': POSTGRES_FORWARDS}),
+            run({'postgresql': POSTGRES_BACKWARDS}),
+        ),
+    ]
@@ -1,23 +1,92 @@
-from django.db import models
+import posixpath
+import uuid
+from decimal import Decimal
+from django.db import models, transaction
 from django.utils.text import slugify
-from django.db.models import Q
+from django.db.models import Q, F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.shortcuts import reverse
 from order.env import config
-import boto3
+import s3
+from .images import get_image_store, read_upload, store_upload, image_url, variant_key
+from .search import SEARCH_LIMIT, search_orders, search_products
+from .thumbnails import THUMBNAIL_FORMATS, schedule_thumbnails, schedule_variant_cleanup, variant_name
 from .validators import validate_file_extension, validate_file_size, validate_image
 
 AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
 AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
 AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default=None)
+AWS_S3_ENDPOINT_URL = config('AWS_S3_ENDPOINT_URL', default=None)
+
+
+def get_s3_client():
+    """The shared, pooled S3 client for the configured bucket."""
+    return s3.shared_client(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_STORAGE_BUCKET_NAME, AWS_S3_ENDPOINT_URL)
 
 
 def product_image_upload_path(instance, filename):
-    """Generate upload path for image."""
-    return f'product/{instance.id}/{filename}'
+    """Generate upload path for image, unique per upload so it doesn't need the row id."""
+    return f'product/{uuid.uuid4().hex}/{filename}'
 
 def category_image_upload_path(instance, filename):
-    """Generate upload path for image."""
-    return f'category/{instance.id}/{filename}'
+    """Generate upload path for image, unique per upload so it doesn't need the row id."""
+    return f'category/{uuid.uuid4().hex}/{filename}'
+
+def sync_image(instance):
+    """
+    Copy a newly uploaded image into the hashed image store, or clear the keys with the image.
+    Returns the bytes of a new upload, for the thumbnail pipeline.
+    """
+    if not instance.image:
+        instance.image_key = ''
+        instance.image_widths = []
+        return None
+    if instance.image._committed:
+        return None
+    content = read_upload(instance.image)
+    instance.image_key, stored = store_upload(content, instance.image.name)
+    if stored:
+        # the field names the hashed object now, its storage must not upload the file again
+        instance.image.name = instance.image_key
+        instance.image._committed = True
+    instance.image_widths = []
+    return content
+
+
+def loaded_image(instance):
+    """(name, key, widths) of the stored image, or None when the image fields were deferred."""
+    if not {'image', 'image_key', 'image_widths'} <= instance.__dict__.keys():
+        return None
+    return (instance.image.name or '', instance.image_key, list(instance.image_widths))
+
+
+def replaced_image(instance):
+    """The image loaded with the row when it has variants and the row now holds another one."""
+    loaded = instance._loaded_image
+    if loaded is None or not loaded[2] or loaded[0] == (instance.image.name or ''):
+        return None
+    return loaded
+
+
+def get_image_url(instance, width=None, ext=None):
+    """Immutable hashed url when the image store has the image, a presigned url otherwise."""
+    if not (instance.image and instance.image.name):
+        return None
+    if instance.image_key and get_image_store() is not None:
+        return image_url(variant_key(instance.image_key, width, ext) if width else instance.image_key)
+    name = variant_name(instance.image.name, width, ext) if width else instance.image.name
+    return get_s3_client().presigned_url(name)
+
+
+def get_image_sources(instance):
+    """srcset per format of the generated thumbnails, e.g. {'webp': 'url 160w, url 320w', 'jpg': ...}"""
+    if not (instance.image and instance.image_widths):
+        return {}
+    return {
+        ext: ', '.join(f"{get_image_url(instance, width, ext)} {width}w" for width in instance.image_widths)
+        for ext, _, _ in THUMBNAIL_FORMATS
+    }
 
 UNIT_CHOICES = [
     ('draft', 'Draft'),
@@ -32,13 +101,9 @@ UNIT_CHOICES = [
 class ProductManager(models.Manager):
     """Manager for Product model."""
 
-    def search(self, query):
-        """Search for product."""
-        return self.filter(
-            Q(name__icontains=query) |
-            Q(size__icontains=query) |
-            Q(unit__icontains=query)
-        ).distinct()
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Search for product, best matches first."""
+        return search_products(self.get_queryset(), query, limit)
 
 class Product(models.Model):
     """Model for product in the shop."""
@@ -50,13 +115,23 @@ class Product(models.Model):
     size = models.CharField(max_length=50)
     handle = models.SlugField(null=True, blank=True)
     image = models.ImageField(upload_to=product_image_upload_path, blank=True, null=True, validators=[validate_file_extension, validate_file_size, validate_image])
+    image_key = models.CharField(max_length=100, blank=True, default='', editable=False)
+    image_widths = models.JSONField(default=list, blank=True, editable=False)
 
     objects = ProductManager()
 
+    _loaded_image = None
+
     class Meta:
         """Meta definition for Product."""
         unique_together = ('name', 'unit', 'size',)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = loaded_image(instance)
+        return instance
+
     def __str__(self):
         return self.name + ' ' + self.size + ' ' + self.unit
 
@@ -64,19 +139,23 @@ class Product(models.Model):
         if not self.handle:
             slug_string = '-'.join([self.name, self.size, self.unit])
             self.handle = slugify(slug_string)
-
-        if self.id is not None:
-            super().save(*args, **kwargs)
-        
-        temp_image = self.image
-        self.image = None
-        super().save(*args, **kwargs)
-
-        self.image = temp_image
+        upload = sync_image(self)
+        replaced = replaced_image(self)
         super().save(*args, **kwargs)
+        if upload is not None:
+            schedule_thumbnails(self, upload)
+        if replaced is not None:
+            schedule_variant_cleanup(replaced)
+        self._loaded_image = loaded_image(self)
 
     def get_prefix(self):
-        return f"product/{self.id}/"
+        return posixpath.dirname(self.image.name) + '/' if self.image else None
+
+    def get_image_url(self):
+        return get_image_url(self)
+
+    def get_image_sources(self):
+        return get_image_sources(self)
     
     def get_files_url(self):
         return reverse('product-files-view', kwargs={'id': self.id})
@@ -89,37 +168,43 @@ class MenuCategory(models.Model):
     handle = models.SlugField(null=True, blank=True)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to=category_image_upload_path, blank=True, null=True, validators=[validate_file_extension, validate_file_size, validate_image])
+    image_key = models.CharField(max_length=100, blank=True, default='', editable=False)
+    image_widths = models.JSONField(default=list, blank=True, editable=False)
+
+    _loaded_image = None
 
     def __str__(self):
         return f"{self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = loaded_image(instance)
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.handle:
             self.handle = slugify(self.name)
-
-        if self.id is not None:
-            super().save(*args, **kwargs)
-        
-        temp_image = self.image
-        self.image = None
-        super().save(*args, **kwargs)
-
-        self.image = temp_image
+        upload = sync_image(self)
+        replaced = replaced_image(self)
         super().save(*args, **kwargs)
+        if upload is not None:
+            schedule_thumbnails(self, upload)
+        if replaced is not None:
+            schedule_variant_cleanup(replaced)
+        self._loaded_image = loaded_image(self)
 
     def get_prefix(self):
-        return f"category/{self.id}/"
+        return posixpath.dirname(self.image.name) + '/' if self.image else None
     
     def get_files_url(self):
         return reverse('menu-category-files-view', kwargs={'id': self.id})
     
     def get_image_url(self):
-        if self.image and self.image.name:
-            s3_client = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-            url = s3_client.generate_presigned_url('get_object', Params={'Bucket': AWS_STORAGE_BUCKET_NAME, 'Key': self.image.name}, ExpiresIn=1000)
-            return url
-        else:
-            return None
+        return get_image_url(self)
+
+    def get_image_sources(self):
+        return get_image_sources(self)
 
 class MenuItem(models.Model):
     """Model for menu item."""
@@ -141,6 +226,44 @@ class MenuItem(models.Model):
             self.handle = slugify(slug_string)
         super().save(*args, **kwargs)
 
+class VersionedModel(models.Model):
+    """
+    Adds a version counter that is bumped on every write, used for ETags.
+    Counter fields are only changed through F() updates, so saving a stale
+    instance never rolls them back.
+    """
+    version = models.PositiveIntegerField(default=0)
+
+    counter_fields = ('version',)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """Updates write the non-counter fields (or update_fields) and bump the version in the same UPDATE."""
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        version = self.version
+        self.version = F('version') + 1
+        try:
+            super().save(*args, update_fields=[*(name for name in update_fields if name != 'version'), 'version'],
+                         **kwargs)
+        finally:
+            self.version = version
+        self.version += 1
+
+    def bump_version(self, **updates):
+        """Increment the version, applying any extra F() updates in the same statement."""
+        type(self)._default_manager.filter(pk=self.pk).update(version=F('version') + 1, **updates)
+        self.version += 1
+
+
 class Section(models.Model):
     name = models.CharField(max_length=50, unique=True)
     notes = models.TextField(blank=True, null=True)
@@ -149,7 +272,17 @@ class Section(models.Model):
         return f"{self.name}"
     
 
-class Table(models.Model):
+class TableQuerySet(models.QuerySet):
+    def claim(self):
+        """Mark the free tables in use with one conditional UPDATE ... WHERE in_use = false. Returns how many were free."""
+        return self.filter(in_use=False).update(in_use=True, version=F('version') + 1)
+
+    def release(self):
+        """Mark the tables free again. Returns how many were in use."""
+        return self.filter(in_use=True).update(in_use=False, version=F('version') + 1)
+
+
+class Table(VersionedModel):
     """Model for table in the restaurant."""
     section = models.ForeignKey(Section, on_delete=models.SET_NULL, null=True, blank=True)
     name = models.CharField(max_length=50)
@@ -157,11 +290,19 @@ class Table(models.Model):
     description = models.TextField(blank=True, null=True)
     # handle = models.SlugField(null=True, blank=True)  DOES NOT NEED A HANDLE
 
+    objects = TableQuerySet.as_manager()
+
+    # in_use only changes through claim() / release(), a stale save must not free a claimed table
+    counter_fields = ('version', 'in_use')
+
     def __str__(self):
         return f"{self.name}"
     
     class Meta:
         unique_together = ('name', 'section',)
+        indexes = [
+            models.Index(fields=['section', 'in_use'], name='table_section_in_use_idx'),
+        ]
 
     # def save(self, *args, **kwargs):
     #     if not self.handle:
@@ -175,23 +316,87 @@ class OrderItem(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE)
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     is_delivered = models.BooleanField(default=False)
 
+    _loaded_line_total = None
+
+    class Meta:
+        indexes = [
+            # kitchen feed / dashboard: undelivered items, looked up by their order
+            models.Index(fields=['order'], condition=Q(is_delivered=False), name='orderitem_undelivered_idx'),
+            # dashboard: items delivered today
+            models.Index(fields=['created'], condition=Q(is_delivered=True), name='orderitem_delivered_idx'),
+        ]
+
     def __str__(self):
         return f"{self.menu_item.product.name} x {self.quantity}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'price' in instance.__dict__ and 'quantity' in instance.__dict__:
+            instance._loaded_line_total = instance.line_total
+        return instance
+
+    @property
+    def line_total(self):
+        """Unit price snapshot times quantity."""
+        return (self.price or 0) * self.quantity
+
+    def save(self, *args, **kwargs):
+        """Snapshot the menu price on create and keep Order.total and Order.version in step with the change."""
+        if self.price is None:
+            self.price = self.menu_item.price
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self.order.update_total(self.line_total)
+            elif self._loaded_line_total is None:
+                self.order.recalculate_total()
+            else:
+                self.order.update_total(self.line_total - self._loaded_line_total)
+        self._loaded_line_total = self.line_total
+
+    def delete(self, *args, **kwargs):
+        line_total = self.line_total
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.order.update_total(-line_total)
+        return result
+
+
+def order_total_expression():
+    """Sum of price * quantity over order items."""
+    return Coalesce(
+        Sum(F('price') * F('quantity')),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
 
 class OrderQuerySet(models.QuerySet):
     def search(self, query):
-        """Search for order."""
-        return self.filter(
-            Q(id__icontains=query) |
-            Q(table__name__icontains=query)|
-            Q(created__icontains=query)|
-            Q(table__section__name__icontains=query)
-        ).distinct()
+        """Search for order by id, day, or table and section name."""
+        return search_orders(self, query)
+
+    def finish(self):
+        """
+        Finish the open orders in this queryset and free their tables with two UPDATEs.
+        Returns the ids of the orders finished; bulk updates bypass save(), so versions are bumped here.
+        """
+        with transaction.atomic():
+            order_ids = list(self.select_for_update().filter(is_finished=False).values_list('id', flat=True))
+            if not order_ids:
+                return []
+            Table.objects.filter(order__id__in=order_ids).release()
+            self.model.objects.filter(id__in=order_ids).update(
+                is_finished=True, updated=timezone.now(), version=F('version') + 1
+            )
+        return order_ids
 
 
 class OrderManager(models.Manager):
@@ -200,8 +405,14 @@ class OrderManager(models.Manager):
         """Search for order."""
         return OrderQuerySet(self.model, using=self._db)
 
+    def search(self, query):
+        return self.get_queryset().search(query)
+
+    def finish(self):
+        return self.get_queryset().finish()
+
 
-class Order(models.Model):
+class Order(VersionedModel):
     """Model for order."""
 
     table = models.ForeignKey(Table, on_delete=models.CASCADE)
@@ -209,16 +420,80 @@ class Order(models.Model):
     updated = models.DateTimeField(auto_now=True)
     is_finished = models.BooleanField(default=False)
     is_paid = models.BooleanField(default=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     objects = OrderManager()
 
+    counter_fields = ('version', 'total')
+
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            # date ranges and the (created, id) keyset pagination of the history
+            models.Index(fields=['created', 'id'], name='order_created_id_idx'),
+            # open orders listing, ETags and the undelivered items join
+            models.Index(fields=['created'], condition=Q(is_finished=False), name='order_open_idx'),
+        ]
 
     @property
     def total_bill(self):
-        """ Calculate total bill for the order."""
-        return sum([item.menu_item.price * item.quantity for item in self.orderitem_set.all()])
+        """ Total bill for the order, maintained incrementally by OrderItem writes."""
+        return self.total
+
+    def update_total(self, amount):
+        """Add amount to the running total, in the database and on this instance. Bumps the version."""
+        self.bump_version(total=F('total') + amount)
+        self.total += amount
+
+    def recalculate_total(self):
+        """Rebuild the running total from the order items."""
+        self.total = self.orderitem_set.aggregate(total=order_total_expression())['total']
+        self.bump_version(total=self.total)
 
     def __str__(self):
         return self.table.name + '- order:' + str(self.id)
+
+
+class DailyMenuItemSales(models.Model):
+    """Rollup of finalized order items per day and menu item."""
+
+    date = models.DateField()
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'menu_item'], name='unique_daily_menu_item_sales'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    """Rollup of finalized order items per day and menu category."""
+
+    date = models.DateField()
+    category = models.ForeignKey(MenuCategory, on_delete=models.SET_NULL, null=True, blank=True)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_daily_category_sales'),
+            # NULLs never collide in the constraint above, uncategorized items get one row per day here
+            models.UniqueConstraint(fields=['date'], condition=Q(category__isnull=True),
+                                    name='unique_daily_uncategorized_sales'),
+        ]
+
+
+class HourlyOrderSales(models.Model):
+    """Rollup of finalized orders per day and hour of opening."""
+
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    orders = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'hour'], name='unique_hourly_order_sales'),
+        ]
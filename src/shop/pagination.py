@@ -0,0 +1,34 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+
+def encode_cursor(obj):
+    """Opaque cursor for the (created, id) position of obj."""
+    raw = f"{obj.created.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created, id) from a cursor, ValueError if it was tampered with."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created, obj_id = raw.split('|')
+        return datetime.fromisoformat(created), int(obj_id)
+    except (UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+def keyset_page(queryset, cursor, page_size):
+    """
+    One page of queryset, newest first, starting after cursor.
+    Seeks on (created, id) instead of OFFSET, so every page costs the same.
+    Returns the objects and the cursor of the next page, or None on the last one.
+    """
+    queryset = queryset.order_by('-created', '-id')
+    if cursor:
+        created, obj_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=obj_id))
+    page = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
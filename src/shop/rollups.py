@@ -0,0 +1,122 @@
+from django.db import connection, transaction
+from django.db.models import Sum, F, Count, Max
+from django.db.models.functions import TruncDate, ExtractHour
+from .models import Order, OrderItem, DailyMenuItemSales, DailyCategorySales, HourlyOrderSales
+
+UPSERT_BATCH_SIZE = 500
+
+
+def upsert_increment(model, key_fields, sum_fields, rows, conflict_fields=None, conflict_where=None):
+    """
+    Add rows of (*keys, *sums) onto the rollup table, creating missing rows.
+    A single INSERT ... ON CONFLICT DO UPDATE per batch, understood by both Postgres and SQLite.
+    conflict_fields and conflict_where name a partial unique constraint to conflict on instead of key_fields.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [model._meta.get_field(name).column for name in (*key_fields, *sum_fields)]
+    target = f"({', '.join(qn(model._meta.get_field(name).column) for name in conflict_fields or key_fields)})"
+    if conflict_where:
+        target += f" WHERE {conflict_where}"
+    updates = ', '.join(
+        f"{qn(column)} = {table}.{qn(column)} + EXCLUDED.{qn(column)}"
+        for column in columns[len(key_fields):]
+    )
+    placeholder = f"({', '.join(['%s'] * len(columns))})"
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(qn(column) for column in columns)}) "
+                f"VALUES {', '.join([placeholder] * len(batch))} "
+                f"ON CONFLICT {target} DO UPDATE SET {updates}",
+                [value for row in batch for value in row]
+            )
+
+
+def rollup_version():
+    """
+    Cheap signature of the rollup contents, used to key cached charts.
+    Every finalized order adds to the order count, a rebuild allocates new ids.
+    """
+    stats = HourlyOrderSales.objects.aggregate(orders=Sum('orders'), last_id=Max('id'))
+    return f"{stats['orders'] or 0}-{stats['last_id'] or 0}"
+
+
+async def arollup_version():
+    stats = await HourlyOrderSales.objects.aaggregate(orders=Sum('orders'), last_id=Max('id'))
+    return f"{stats['orders'] or 0}-{stats['last_id'] or 0}"
+
+
+def record_finished_orders(order_ids):
+    """Fold the given, just finalized, orders into the sales rollups."""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    items = OrderItem.objects.filter(order_id__in=order_ids).annotate(date=TruncDate('created')).order_by()
+    by_menu_item = items.values('date', 'menu_item_id').annotate(
+        total_quantity=Sum('quantity'), total_revenue=Sum(F('price') * F('quantity'))
+    )
+    by_category = items.values('date', 'menu_item__category_id').annotate(
+        total_quantity=Sum('quantity'), total_revenue=Sum(F('price') * F('quantity'))
+    )
+    by_hour = Order.objects.filter(id__in=order_ids).annotate(
+        date=TruncDate('created'), hour=ExtractHour('created')
+    ).order_by().values('date', 'hour').annotate(total_orders=Count('id'), total_revenue=Sum('total'))
+
+    with transaction.atomic():
+        upsert_increment(DailyMenuItemSales, ('date', 'menu_item'), ('quantity', 'revenue'), [
+            (row['date'], row['menu_item_id'], row['total_quantity'], row['total_revenue'])
+            for row in by_menu_item
+        ])
+        by_category = [
+            (row['date'], row['menu_item__category_id'], row['total_quantity'], row['total_revenue'])
+            for row in by_category
+        ]
+        upsert_increment(DailyCategorySales, ('date', 'category'), ('quantity', 'revenue'),
+                         [row for row in by_category if row[1] is not None])
+        upsert_increment(DailyCategorySales, ('date', 'category'), ('quantity', 'revenue'),
+                         [row for row in by_category if row[1] is None],
+                         conflict_fields=('date',), conflict_where='category_id IS NULL')
+        upsert_increment(HourlyOrderSales, ('date', 'hour'), ('orders', 'revenue'), [
+            (row['date'], row['hour'], row['total_orders'], row['total_revenue'])
+            for row in by_hour
+        ])
+
+
+def lock_rollups():
+    """
+    Hold off finalizations until the transaction ends: their upserts wait on the rollup tables.
+    SQLite already serializes writers.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    qn = connection.ops.quote_name
+    tables = ', '.join(qn(model._meta.db_table) for model in (DailyMenuItemSales, DailyCategorySales, HourlyOrderSales))
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {tables} IN EXCLUSIVE MODE")
+
+
+def rebuild_rollups(chunk_size=1000, stdout=None):
+    """
+    Drop the rollups and rebuild them from every finalized order, chunk_size orders at a time.
+    Each chunk commits on its own, so locks stay short but the charts show a partial history until it finishes.
+    The orders to rebuild are picked while the emptied tables are locked; an order finalized later rolls
+    itself up, so it is left out here rather than counted twice.
+    """
+    with transaction.atomic():
+        lock_rollups()
+        for model in (DailyMenuItemSales, DailyCategorySales, HourlyOrderSales):
+            model.objects.all().delete()
+        order_ids = list(Order.objects.filter(is_finished=True).order_by('id').values_list('id', flat=True))
+    processed = 0
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        # one transaction per chunk, see record_finished_orders
+        record_finished_orders(chunk)
+        processed += len(chunk)
+        if stdout is not None:
+            stdout.write(f"{processed} orders rolled up")
+    return processed
@@ -0,0 +1,151 @@
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Q, Case, F, Func, TextField, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils import timezone
+
+SEARCH_LIMIT = 50
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%d.%m', '%d/%m')
+# below this pg_trgm word similarity a product is not a fuzzy match, applied to every connection below
+TRIGRAM_THRESHOLD = 0.3
+
+
+@receiver(connection_created)
+def set_trigram_threshold(sender, connection, **kwargs):
+    """The %> operator, and so the trigram index, only knows the session threshold (pg_trgm defaults to 0.6)."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)",
+                           [str(TRIGRAM_THRESHOLD)])
+
+
+@dataclass
+class ParsedQuery:
+    """A search box query, with the exact lookups it can stand for."""
+    text: str
+    number: int = None
+    day: date = None
+
+
+def parse_query(query):
+    """'42' is also an id, '2024-05-01' / '01.05.2024' / '01.05' a day, anything else text only."""
+    text = ' '.join(query.split())
+    parsed = ParsedQuery(text=text)
+    if text.isdigit():
+        parsed.number = int(text)
+    for fmt in DATE_FORMATS:
+        try:
+            day = datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+        # formats without a year mean this year
+        parsed.day = day if '%Y' in fmt else day.replace(year=timezone.localdate().year)
+        break
+    return parsed
+
+
+def search_orders(orders, query):
+    """
+    Orders matching query: by id or table name for a number, by day for a date,
+    else by table or section name. Every branch is an indexed lookup on the order row.
+    """
+    from .models import Table
+
+    parsed = parse_query(query)
+    if not parsed.text:
+        return orders
+    if parsed.number is not None:
+        return orders.filter(Q(id=parsed.number) | Q(table_id__in=Table.objects.filter(name__iexact=parsed.text).values('id')))
+    if parsed.day is not None:
+        start = timezone.make_aware(datetime.combine(parsed.day, time.min))
+        return orders.filter(created__gte=start, created__lt=start + timedelta(days=1))
+    tables = Table.objects.filter(Q(name__icontains=parsed.text) | Q(section__name__icontains=parsed.text))
+    return orders.filter(table_id__in=tables.values('id'))
+
+
+def ranked(queryset, ids):
+    """queryset limited to ids, in the order of ids."""
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).order_by(Case(*[When(id=pk, then=rank) for rank, pk in enumerate(ids)]))
+
+
+class SearchBackend:
+    """icontains fallback for databases without a text index."""
+
+    def search_products(self, products, text, limit):
+        words = text.split()
+        query = Q()
+        for word in words:
+            query &= Q(name__icontains=word) | Q(size__icontains=word) | Q(unit__icontains=word)
+        return products.filter(query).order_by('name')[:limit]
+
+
+class ProductDocument(Func):
+    """
+    name, size, unit and description as one text, the fields the SQLite FTS5 index covers.
+    Concatenated with || (CONCAT() is not immutable): migration 0030 indexes this exact expression.
+    """
+    arg_joiner = " || ' ' || "
+    template = '(%(expressions)s)'
+    output_field = TextField()
+
+    def __init__(self):
+        super().__init__(F('name'), F('size'), F('unit'), Coalesce(F('description'), Value('')))
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    pg_trgm: every word a substring or fuzzy match of the product document, served by GIN trigram indexes.
+    Ranked by similarity, the name weighing double like in the bm25 ranking on SQLite.
+    """
+
+    def search_products(self, products, text, limit):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        query = Q()
+        for word in text.split():
+            query &= Q(document__icontains=word) | Q(document__trigram_word_similar=word)
+        return (
+            products.alias(document=ProductDocument()).filter(query)
+            .annotate(rank=TrigramWordSimilarity(text, 'name') * 2 + TrigramWordSimilarity(text, 'document'))
+            .order_by('-rank', 'name')[:limit]
+        )
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 index over name, size, unit and description, ranked by bm25."""
+
+    def search_products(self, products, text, limit):
+        # every word as a quoted prefix, e.g. "bee"* "dra"*
+        words = re.findall(r'\w+', text)
+        if not words:
+            return products.none()
+        match = ' '.join(f'"{word}"*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM shop_product_fts WHERE shop_product_fts MATCH %s "
+                "ORDER BY bm25(shop_product_fts, 10.0, 2.0, 2.0, 1.0) LIMIT %s",
+                [match, limit]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        return ranked(products, ids)
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    return SearchBackend()
+
+
+def search_products(products, query, limit=SEARCH_LIMIT):
+    """The limit best matching products, best first."""
+    text = parse_query(query).text
+    if not text:
+        return products.none()
+    return get_search_backend().search_products(products, text, limit)
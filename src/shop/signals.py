@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from .feed import broker
+from .menu_cache import invalidate_menu
+from .models import MenuCategory, MenuItem, Order, OrderItem, Product
+
+
+def publish_item_added(item_id):
+    item = OrderItem.objects.select_related('menu_item__product', 'order__table').filter(
+        id=item_id, order__is_finished=False, is_delivered=False).first()
+    if item is not None:
+        broker.publish('added', render_to_string('partials/undelivered_item_row.html', {'item': item}))
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, **kwargs):
+    """Push added and delivered items to the kitchen feed once the write is committed."""
+    if not broker.has_subscribers:
+        return
+    item_id = instance.id
+    if created and not instance.is_delivered:
+        transaction.on_commit(lambda: publish_item_added(item_id))
+    elif instance.is_delivered:
+        transaction.on_commit(lambda: broker.publish('removed', item_id))
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    if broker.has_subscribers:
+        item_id = instance.id
+        transaction.on_commit(lambda: broker.publish('removed', item_id))
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    """Items of a finished order leave the undelivered list."""
+    if broker.has_subscribers and instance.is_finished:
+        order_id = instance.id
+        transaction.on_commit(lambda: broker.publish('order-finished', order_id))
+
+
+def publish_orders_finished(order_ids):
+    """Bulk counterpart of order_saved, for orders finished with a queryset update."""
+    if broker.has_subscribers:
+        order_ids = list(order_ids)
+        transaction.on_commit(lambda: [broker.publish('order-finished', order_id) for order_id in order_ids])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=MenuItem)
+@receiver([post_save, post_delete], sender=MenuCategory)
+def menu_changed(sender, **kwargs):
+    """The cached menu is rebuilt on the next menu page after any menu write."""
+    invalidate_menu()
@@ -1,3 +1,1490 @@
-from django.test import TestCase
+import asyncio
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import partial
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from django.apps import apps as django_apps
+from django.contrib.staticfiles import finders
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db.models import Sum
+from django.db import OperationalError, connection
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+import plotly
+import s3
+from . import benchmarks, instrumentation, loadgen, menu_cache, rollups, search, thumbnails, urls as shop_urls
+from .exports import EXPORT_FORMATS, csv_chunks, order_rows
+from .feed import broker, format_event
+from .search import parse_query
+from .forms import ProductForm
+from .images import get_image_store, variant_key
+from .thumbnails import THUMBNAIL_FORMATS
+from .models import (get_image_url, get_s3_client, order_total_expression, Product, MenuCategory, MenuItem, Section, Table, Order,
+                     OrderItem, DailyMenuItemSales, DailyCategorySales, HourlyOrderSales)
 
-# Create your tests here.
+
+class TemporaryMediaMixin:
+    """
+    Uploads and served images go to a throwaway directory on the local file system,
+    never to the S3 bucket DEFAULT_FILE_STORAGE points at. media_settings adds overrides.
+    """
+    media_settings = {}
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.media_root = root.name
+        settings = override_settings(DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+                                     MEDIA_ROOT=root.name, IMAGE_ROOT=root.name, **self.media_settings)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class OrderTotalsTestCase(TestCase):
+    """Order totals are computed by the database, not per order."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = MenuCategory(name='Drinks')
+        category.save()
+        section = Section.objects.create(name='Garden')
+        cls.menu_items = []
+        for i in range(3):
+            product = Product(name=f'Beer {i}', size='50cl', unit='draft')
+            product.save()
+            cls.menu_items.append(
+                MenuItem.objects.create(product=product, category=category, price=Decimal('10.50') * (i + 1))
+            )
+        for i in range(10):
+            table = Table.objects.create(name=f'T{i}', section=section, in_use=True)
+            order = Order.objects.create(table=table)
+            for menu_item in cls.menu_items:
+                OrderItem.objects.create(order=order, menu_item=menu_item, quantity=2)
+
+    def test_totals_match_items(self):
+        expected = sum(item.price * 2 for item in self.menu_items)
+        for order in Order.objects.all():
+            self.assertEqual(order.total_bill, expected)
+
+    def test_empty_order_total_is_zero(self):
+        order = Order.objects.create(table=Table.objects.first())
+        self.assertEqual(Order.objects.get(id=order.id).total_bill, Decimal('0.00'))
+        self.assertEqual(order.total_bill, Decimal('0.00'))
+
+    def test_totals_are_single_query(self):
+        with self.assertNumQueries(1):
+            totals = [order.total_bill for order in Order.objects.all()]
+        self.assertEqual(len(totals), 10)
+
+    def test_open_orders_view_query_count_is_constant(self):
+        self.client.get(reverse('open-orders-view'))
+        # ETag signature + listing
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('open-orders-view'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_historical_orders_view_query_count_is_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('historical-orders-view'), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard_total_gain(self):
+        response = self.client.get(reverse('home-view'))
+        expected = sum(item.price * 2 for item in self.menu_items) * 10
+        self.assertEqual(response.context['total_gain'], expected)
+
+
+class OrderRunningTotalTestCase(TestCase):
+    """OrderItem writes snapshot the price and keep Order.total up to date."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product(name='Pizza', size='30cm', unit='plate')
+        product.save()
+        cls.menu_item = MenuItem.objects.create(product=product, price=Decimal('12.00'))
+        section = Section.objects.create(name='Hall')
+        cls.table = Table.objects.create(name='H1', section=section, in_use=True)
+
+    def setUp(self):
+        self.order = Order.objects.create(table=self.table)
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+
+    def test_price_snapshot_survives_price_change(self):
+        item = OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=2)
+        self.menu_item.price = Decimal('20.00')
+        self.menu_item.save()
+        item.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(item.price, Decimal('12.00'))
+        self.assertEqual(self.order.total, Decimal('24.00'))
+
+    def test_quantity_change_updates_total(self):
+        item = OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=2)
+        item = OrderItem.objects.get(id=item.id)
+        item.quantity = 3
+        item.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('36.00'))
+
+    def test_create_and_delete_views_update_total(self):
+        response = self.client.post(
+            reverse('order-item-create-view', kwargs={'item_id': self.menu_item.id}) + '?quantity=3'
+        )
+        self.assertContains(response, 'Total Bill: 36.00')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('36.00'))
+
+        item = self.order.orderitem_set.get()
+        response = self.client.post(reverse('delete-order-item-view', kwargs={'item_id': item.id}))
+        self.assertContains(response, 'Total Bill: 0.00')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('0.00'))
+        self.assertEqual(self.order.total, self.order.orderitem_set.aggregate(total=order_total_expression())['total'])
+
+
+class UndeliveredItemsFeedTestCase(TestCase):
+    """OrderItem writes are pushed to kitchen feed subscribers after commit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product(name='Espresso', size='double', unit='glass')
+        product.save()
+        cls.menu_item = MenuItem.objects.create(product=product, price=Decimal('4.00'))
+        section = Section.objects.create(name='Bar')
+        cls.table = Table.objects.create(name='B1', section=section, in_use=True)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.queue = broker.subscribe(self.loop)
+
+    def tearDown(self):
+        broker.unsubscribe(self.queue)
+        self.loop.close()
+
+    def next_event(self):
+        return self.loop.run_until_complete(asyncio.wait_for(self.queue.get(), timeout=1))
+
+    def test_added_delivered_and_finished_events(self):
+        order = Order.objects.create(table=self.table)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = OrderItem.objects.create(order=order, menu_item=self.menu_item, quantity=1)
+        event, data = self.next_event()
+        self.assertEqual(event, 'added')
+        self.assertIn(f'id="undelivered-item-{item.id}"', data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.is_delivered = True
+            item.save()
+        self.assertEqual(self.next_event(), ('removed', item.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.is_finished = True
+            order.save()
+        self.assertEqual(self.next_event(), ('order-finished', order.id))
+
+    def test_no_event_without_commit(self):
+        order = Order.objects.create(table=self.table)
+        with self.captureOnCommitCallbacks(execute=False):
+            OrderItem.objects.create(order=order, menu_item=self.menu_item, quantity=1)
+        self.assertTrue(self.queue.empty())
+
+    def test_format_event(self):
+        self.assertEqual(format_event('added', '<tr>\n</tr>'), 'event: added\ndata: <tr>\ndata: </tr>\n\n')
+
+    def test_stream_is_disabled_under_wsgi(self):
+        response = self.client.get(reverse('undelivered-items-stream-view'))
+        self.assertEqual(response.status_code, 204)
+
+    def test_card_revalidates_while_connected(self):
+        # the broker is per worker, the card still polls slowly to pick up writes served elsewhere
+        response = self.client.get(reverse('undelivered-items-view'), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'every 30s [window.undeliveredFeed && ')
+
+
+class ConditionalPartialsTestCase(TestCase):
+    """Polled partials answer 304 until a write bumps an order or table version."""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product(name='Lemonade', size='40cl', unit='glass')
+        product.save()
+        cls.menu_item = MenuItem.objects.create(product=product, price=Decimal('6.00'))
+        cls.section = Section.objects.create(name='Terrace')
+        cls.table = Table.objects.create(name='T1', section=cls.section)
+
+    def setUp(self):
+        self.order = Order.objects.create(table=self.table)
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+
+    def assertNotModifiedUntil(self, url, write):
+        response = self.client.get(url, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        write()
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_order_items_partial(self):
+        self.assertNotModifiedUntil(
+            reverse('partial-order-items-list-view'),
+            lambda: OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=1)
+        )
+
+    def test_undelivered_items_partial(self):
+        item = OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=1)
+
+        def deliver():
+            item.is_delivered = True
+            item.save()
+        self.assertNotModifiedUntil(reverse('undelivered-items-view'), deliver)
+
+    def test_open_orders_partial(self):
+        def pay():
+            self.order.is_paid = True
+            self.order.save()
+        self.assertNotModifiedUntil(reverse('open-orders-view'), pay)
+
+    def test_available_tables_partial(self):
+        self.assertNotModifiedUntil(reverse('available-tables-view', kwargs={'section_id': self.section.id}),
+                                    lambda: Table.objects.filter(id=self.table.id).claim())
+
+    def test_product_rename_changes_etags(self):
+        OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=1)
+
+        for name, url in (('Pink lemonade', reverse('undelivered-items-view')),
+                          ('Iced tea', reverse('partial-order-items-list-view'))):
+            def rename():
+                product = Product.objects.get(id=self.menu_item.product_id)
+                product.name = name
+                product.save()
+            with self.subTest(url=url):
+                self.assertNotModifiedUntil(url, rename)
+
+    def test_section_rename_changes_etag(self):
+        def rename():
+            self.section.name = 'Roof'
+            self.section.save()
+        self.assertNotModifiedUntil(reverse('open-orders-view'), rename)
+
+    def test_save_is_one_update(self):
+        order = Order.objects.get(id=self.order.id)
+        order.is_paid = True
+        with CaptureQueriesContext(connection) as ctx:
+            order.save()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('"version" = (', ctx.captured_queries[0]['sql'])
+        self.assertEqual(order.version, 1)
+        order.refresh_from_db()
+        self.assertEqual((order.is_paid, order.version), (True, 1))
+
+    def test_partial_save_bumps_version(self):
+        self.order.is_paid = True
+        self.order.save(update_fields=['is_paid'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.version, 1)
+
+    def test_stale_save_keeps_counters(self):
+        stale = Order.objects.get(id=self.order.id)
+        OrderItem.objects.create(order=self.order, menu_item=self.menu_item, quantity=2)
+        stale.is_paid = True
+        stale.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total, Decimal('12.00'))
+        self.assertEqual(self.order.version, 2)
+
+
+class SalesRollupsTestCase(TestCase):
+    """Finalizing orders folds them into the rollups the charts read."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = MenuCategory(name='Food')
+        cls.category.save()
+        product = Product(name='Burger', size='200g', unit='plate')
+        product.save()
+        cls.menu_item = MenuItem.objects.create(product=product, category=cls.category, price=Decimal('15.00'))
+        section = Section.objects.create(name='Patio')
+        cls.tables = [Table.objects.create(name=f'P{i}', section=section, in_use=True) for i in range(3)]
+
+    def setUp(self):
+        self.orders = []
+        for table in self.tables:
+            order = Order.objects.create(table=table)
+            OrderItem.objects.create(order=order, menu_item=self.menu_item, quantity=2)
+            self.orders.append(order)
+
+    def rollup_totals(self):
+        return (
+            DailyMenuItemSales.objects.aggregate(quantity=Sum('quantity'), revenue=Sum('revenue')),
+            DailyCategorySales.objects.filter(category=self.category).aggregate(revenue=Sum('revenue'))['revenue'],
+            HourlyOrderSales.objects.aggregate(orders=Sum('orders'), revenue=Sum('revenue')),
+        )
+
+    def test_finalize_updates_rollups_once(self):
+        url = reverse('finalize-order-view', kwargs={'order_id': self.orders[0].id})
+        self.client.post(url)
+        self.client.post(url)
+        by_item, by_category, by_hour = self.rollup_totals()
+        self.assertEqual(by_item, {'quantity': 2, 'revenue': Decimal('30.00')})
+        self.assertEqual(by_category, Decimal('30.00'))
+        self.assertEqual(by_hour, {'orders': 1, 'revenue': Decimal('30.00')})
+
+    def test_finish_all_and_rebuild_agree(self):
+        self.client.post(reverse('finish-open-orders-view'))
+        incremental = self.rollup_totals()
+        self.assertEqual(incremental[2], {'orders': 3, 'revenue': Decimal('90.00')})
+        call_command('rebuild_rollups', chunk_size=2, stdout=StringIO())
+        self.assertEqual(self.rollup_totals(), incremental)
+
+    def test_order_finalized_during_rebuild_counts_once(self):
+        Order.objects.filter(id__in=[order.id for order in self.orders[:2]]).finish()
+        record_finished_orders = rollups.record_finished_orders
+        late = self.orders[2]
+
+        def finalize_late_order(order_ids):
+            record_finished_orders(order_ids)
+            self.client.post(reverse('finalize-order-view', kwargs={'order_id': late.id}))
+        with mock.patch.object(rollups, 'record_finished_orders', side_effect=finalize_late_order):
+            rollups.rebuild_rollups(chunk_size=1)
+        self.assertEqual(self.rollup_totals()[2], {'orders': 3, 'revenue': Decimal('90.00')})
+
+    def test_migration_backfills_finalized_orders(self):
+        self.client.post(reverse('finish-open-orders-view'))
+        incremental = self.rollup_totals()
+        DailyMenuItemSales.objects.all().delete()
+        DailyCategorySales.objects.all().delete()
+        HourlyOrderSales.objects.all().delete()
+        import_module('shop.migrations.0029_backfill_sales_rollups').backfill_rollups(django_apps, None)
+        self.assertEqual(self.rollup_totals(), incremental)
+
+    def test_uncategorized_items_share_a_row(self):
+        product = Product(name='Bread', size='basket', unit='plate')
+        product.save()
+        menu_item = MenuItem.objects.create(product=product, price=Decimal('2.00'))
+        for order in self.orders:
+            OrderItem.objects.create(order=order, menu_item=menu_item, quantity=1)
+            self.client.post(reverse('finalize-order-view', kwargs={'order_id': order.id}))
+        uncategorized = DailyCategorySales.objects.filter(category__isnull=True)
+        self.assertEqual(list(uncategorized.values_list('quantity', 'revenue')), [(3, Decimal('6.00'))])
+
+    def test_charts_read_rollups_only(self):
+        cache.clear()
+        self.client.post(reverse('finish-open-orders-view'))
+        # rollup version + one query per chart
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('charts-view'), HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<script src=')
+        self.assertContains(response, 'Burger 200g plate')
+
+    def test_plotly_is_served_from_the_installed_package(self):
+        self.assertEqual(finders.find('plotly/plotly.min.js'),
+                         str(Path(plotly.__file__).parent / 'package_data' / 'plotly.min.js'))
+        self.assertIsNone(finders.find('plotly/widgetbundle.js'))
+
+    def test_charts_are_cached_per_rollup_version(self):
+        cache.clear()
+        first = self.client.get(reverse('charts-view'), HTTP_HX_REQUEST='true')
+        with self.assertNumQueries(1):
+            cached = self.client.get(reverse('charts-view'), HTTP_HX_REQUEST='true')
+        self.assertEqual(first.content, cached.content)
+        self.client.post(reverse('finish-open-orders-view'))
+        refreshed = self.client.get(reverse('charts-view'), HTTP_HX_REQUEST='true')
+        self.assertNotEqual(first.content, refreshed.content)
+
+    def test_charts_window_and_granularity(self):
+        cache.clear()
+        self.client.post(reverse('finish-open-orders-view'))
+        today = timezone.now().date()
+        for granularity in ('hour', 'day', 'week', 'month'):
+            response = self.client.get(reverse('charts-view'), {
+                'from': today.isoformat(), 'to': today.isoformat(), 'granularity': granularity
+            }, HTTP_HX_REQUEST='true')
+            self.assertContains(response, 'Burger 200g plate')
+        response = self.client.get(reverse('charts-view'), {
+            'from': (today - timedelta(days=10)).isoformat(), 'to': (today - timedelta(days=5)).isoformat()
+        }, HTTP_HX_REQUEST='true')
+        self.assertNotContains(response, 'Burger 200g plate')
+        response = self.client.get(reverse('charts-view'), {'from': today.isoformat(), 'to': '2000-01-01'},
+                                   HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 400)
+
+
+class HotFilterIndexesTestCase(TestCase):
+    """The hot filters are answered from their indexes (SQLite's EXPLAIN QUERY PLAN stands in for Postgres)."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_open_orders_use_partial_index(self):
+        self.assertUsesIndex(Order.objects.filter(is_finished=False), 'order_open_idx')
+
+    def test_created_ranges_use_index(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            Order.objects.filter(created__gte=now - timedelta(days=1), created__lt=now).order_by(), 'order_created_id_idx'
+        )
+        self.assertUsesIndex(
+            OrderItem.objects.filter(is_delivered=True, created__gte=now - timedelta(days=1), created__lt=now),
+            'orderitem_delivered_idx'
+        )
+
+    def test_undelivered_items_use_partial_index(self):
+        self.assertUsesIndex(OrderItem.objects.filter(order_id=1, is_delivered=False), 'orderitem_undelivered_idx')
+
+    def test_tables_by_section_use_index(self):
+        self.assertUsesIndex(Table.objects.filter(section_id=1, in_use=False), 'table_section_in_use_idx')
+
+
+class OrderMiddlewareTestCase(TestCase):
+    """request.order is resolved lazily, once per request."""
+
+    @classmethod
+    def setUpTestData(cls):
+        section = Section.objects.create(name='Lounge')
+        cls.order = Order.objects.create(table=Table.objects.create(name='L1', section=section))
+
+    def setUp(self):
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+
+    def test_untouched_order_costs_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('charts-view'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_is_loaded_once_with_table_and_section(self):
+        # session, order (with table and section), ETag signature, order items
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('partial-order-items-list-view'))
+        self.assertEqual(response.context['order'], self.order)
+
+
+class SharedS3ClientTestCase(TestCase):
+    """One pooled S3 client per process, presigned urls reused until close to expiry."""
+
+    def setUp(self):
+        self.client_s3 = s3.S3Client(
+            aws_access_key_id='test', aws_secret_access_key='test', default_bucket_name='bucket'
+        )
+
+    def test_shared_client_is_reused(self):
+        self.assertIs(get_s3_client(), get_s3_client())
+
+    def test_presigned_url_is_cached_until_expiry_margin(self):
+        with mock.patch.object(self.client_s3.client, 'generate_presigned_url', return_value='url') as sign:
+            self.assertEqual(self.client_s3.presigned_url('product/1/a.jpg'), 'url')
+            self.assertEqual(self.client_s3.presigned_url('product/1/a.jpg'), 'url')
+            self.assertEqual(sign.call_count, 1)
+            with mock.patch('s3.client.time.monotonic', return_value=time.monotonic() + 900):
+                self.client_s3.presigned_url('product/1/a.jpg')
+            self.assertEqual(sign.call_count, 2)
+
+    @mock.patch.multiple('shop.models', AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test',
+                         AWS_STORAGE_BUCKET_NAME='bucket')
+    def test_files_view_does_not_head_object(self):
+        product = Product(name='Donut', size='1', unit='plate')
+        product.save()
+        Product.objects.filter(id=product.id).update(image='product/1/donut.jpg')
+        menu_item = MenuItem.objects.create(product=product, price=Decimal('3.00'))
+        shared = get_s3_client()
+        with mock.patch.object(shared.client, 'head_object', side_effect=AssertionError) as head:
+            response = self.client.get(
+                reverse('menu-item-files-view', kwargs={'menu_item_id': menu_item.id}), HTTP_HX_REQUEST='true'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(head.called)
+        self.assertTrue(response.context['data']['is_image'])
+        self.assertIn('donut.jpg', response.context['data']['url'])
+
+
+@mock.patch.multiple('shop.models', AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test',
+                     AWS_STORAGE_BUCKET_NAME='bucket')
+class MenuImagesTestCase(TestCase):
+    """Menu grids carry their image urls inline, no request per tile."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = MenuCategory(name='Desserts')
+        cls.category.save()
+        cls.items = []
+        for i in range(5):
+            product = Product(name=f'Pie {i}', size='slice', unit='plate')
+            product.save()
+            Product.objects.filter(id=product.id).update(image=f'product/{product.id}/pie.jpg')
+            cls.items.append(MenuItem.objects.create(product=product, category=cls.category, price=Decimal('5.00')))
+
+    def test_menu_items_page_inlines_urls(self):
+        # category, items with products
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('menu-item-list-view', kwargs={'category_handle': self.category.handle}))
+        self.assertNotContains(response, 'hx-get="/menu-item/files/img/')
+        self.assertContains(response, 'pie.jpg', count=5)
+
+    def test_batch_endpoint(self):
+        response = self.client.get(reverse('menu-category-images-view', kwargs={'category_handle': self.category.handle}))
+        data = response.json()
+        self.assertIsNone(data['category'])
+        self.assertEqual(sorted(data['items']), sorted(str(item.id) for item in self.items))
+        self.assertIn('pie.jpg', data['items'][str(self.items[0].id)])
+
+
+class HashedImagesTestCase(TemporaryMediaMixin, TestCase):
+    """Images served from content-hashed keys with immutable caching."""
+    media_settings = {'IMAGE_BACKEND': 'local'}
+
+    def test_upload_is_served_immutable(self):
+        product = Product(name='Cola', size='33cl', unit='can',
+                          image=SimpleUploadedFile('cola.png', b'png bytes', content_type='image/png'))
+        product.save()
+        self.assertRegex(product.image_key, r'^img/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        url = product.get_image_url()
+        self.assertEqual(url, reverse('image-view', kwargs={'key': product.image_key}))
+
+        response = self.client.get(url)
+        self.assertEqual(response.content, b'png bytes')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_same_content_same_key(self):
+        keys = []
+        for name in ('Cola', 'Fanta'):
+            product = Product(name=name, size='33cl', unit='can',
+                              image=SimpleUploadedFile(f'{name}.png', b'same bytes'))
+            product.save()
+            keys.append(product.image_key)
+        self.assertEqual(keys[0], keys[1])
+
+    @override_settings(IMAGE_CDN_URL='https://cdn.example.com/')
+    def test_cdn_url(self):
+        category = MenuCategory(name='Soft drinks', image=SimpleUploadedFile('soft.jpg', b'jpg bytes'))
+        category.save()
+        self.assertEqual(category.get_image_url(), f'https://cdn.example.com/{category.image_key}')
+
+    def test_unknown_and_malformed_keys(self):
+        self.assertEqual(self.client.get(reverse('image-view', kwargs={'key': 'img/00/' + '0' * 64 + '.png'})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('image-view', kwargs={'key': '../settings.py'})).status_code, 404)
+
+
+class S3HashedImagesTestCase(TemporaryMediaMixin, TestCase):
+    """With the s3 backend an upload is written once, straight to its hashed key."""
+    media_settings = {'IMAGE_BACKEND': 's3', 'THUMBNAIL_WORKERS': 0}
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.multiple('shop.models', AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test',
+                                              AWS_STORAGE_BUCKET_NAME='bucket'))
+        client = get_s3_client()
+        self.put = self.enterContext(mock.patch.object(client, 'put_object'))
+        self.head = self.enterContext(mock.patch.object(client, 'exists', side_effect=AssertionError))
+
+    def test_upload_is_put_once(self):
+        product = Product(name='Cola', size='33cl', unit='can', image=SimpleUploadedFile('cola.png', b'png bytes'))
+        product.save()
+        self.assertRegex(product.image_key, r'^img/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.put.assert_called_once_with(product.image_key, b'png bytes', 'image/png',
+                                         cache_control='public, max-age=31536000, immutable')
+        self.assertFalse(self.head.called)
+        product.refresh_from_db()
+        self.assertEqual(product.image.name, product.image_key)
+        self.assertFalse(default_storage.exists(product.image_key))
+        self.assertEqual(product.get_image_url(), reverse('image-view', kwargs={'key': product.image_key}))
+
+    def test_replacing_a_shared_image_keeps_it(self):
+        products = [Product.objects.create(name=name, size='33cl', unit='can',
+                                           image=SimpleUploadedFile(f'{name}.png', b'same bytes'))
+                    for name in ('Cola', 'Fanta')]
+        self.assertEqual(products[0].image.name, products[1].image.name)
+        form = ProductForm(instance=Product.objects.get(id=products[0].id))
+        form.cleaned_data = {'image': SimpleUploadedFile('new.png', b'new bytes')}
+        with mock.patch.object(FileSystemStorage, 'delete') as delete:
+            form.clean_image()
+        self.assertFalse(delete.called)
+
+
+class ThumbnailPipelineTestCase(TemporaryMediaMixin, TestCase):
+    """Uploads are decoded once and resized into srcset variants after the commit."""
+    media_settings = {'IMAGE_BACKEND': 'local', 'THUMBNAIL_WORKERS': 0}
+
+    def upload(self, size=(1000, 800), name='photo.jpg'):
+        output = BytesIO()
+        Image.new('RGB', size, 'orange').save(output, format='JPEG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+    def test_variants_generated_on_commit(self):
+        product = Product(name='Juice', size='25cl', unit='glass', image=self.upload())
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            product.save()
+        # one thumbnail job, besides the menu cache invalidations
+        self.assertEqual(len([callback for callback in callbacks if callback is not menu_cache.bump_version]), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.image_widths, [160, 320, 640])
+
+        sources = product.get_image_sources()
+        self.assertEqual(sorted(sources), sorted(ext for ext, _, _ in THUMBNAIL_FORMATS))
+        self.assertIn('jpg', sources)
+        self.assertIn('-640.webp 640w', sources['webp'])
+        response = self.client.get(sources['webp'].split(', ')[1].split(' ')[0])
+        variant = Image.open(BytesIO(response.content))
+        self.assertEqual((variant.format, variant.size), ('WEBP', (320, 256)))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_small_image_single_variant(self):
+        category = MenuCategory(name='Snacks', image=self.upload(size=(120, 90)))
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        category.refresh_from_db()
+        self.assertEqual(category.image_widths, [120])
+
+    @override_settings(IMAGE_BACKEND='presigned')
+    def test_presigned_variants_next_to_upload(self):
+        product = Product(name='Lemonade', size='25cl', unit='glass', image=self.upload())
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        for width in (160, 320, 640):
+            self.assertTrue(default_storage.exists(f'{product.get_prefix()}photo-{width}.webp'))
+            self.assertTrue(default_storage.exists(f'{product.get_prefix()}photo-{width}.jpg'))
+
+    def replace_image(self, product, size):
+        product = Product.objects.get(id=product.id)
+        product.image = self.upload(size=size)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        return product
+
+    def test_replace_deletes_old_variants(self):
+        product = Product(name='Tonic', size='20cl', unit='bottle', image=self.upload())
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        store = get_image_store()
+        old = [variant_key(product.image_key, width, 'webp') for width in product.image_widths]
+        self.assertTrue(all(store.exists(key) for key in old))
+        product = self.replace_image(product, (900, 700))
+        self.assertFalse(any(store.exists(key) for key in old))
+        product.refresh_from_db()
+        self.assertTrue(store.exists(variant_key(product.image_key, 640, 'webp')))
+
+    def test_shared_variants_are_kept(self):
+        products = []
+        for name in ('Still water', 'Sparkling water'):
+            product = Product(name=name, size='50cl', unit='bottle', image=self.upload())
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+            products.append(product)
+        self.replace_image(products[0], (900, 700))
+        products[1].refresh_from_db()
+        self.assertTrue(get_image_store().exists(variant_key(products[1].image_key, 640, 'webp')))
+
+    @override_settings(IMAGE_BACKEND='presigned')
+    def test_presigned_replace_deletes_old_variants(self):
+        product = Product(name='Iced tea', size='25cl', unit='glass', image=self.upload())
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        old_prefix = product.get_prefix()
+        product = self.replace_image(product, (900, 700))
+        self.assertFalse(default_storage.exists(f'{old_prefix}photo-640.webp'))
+        self.assertTrue(default_storage.exists(f'{product.get_prefix()}photo-640.webp'))
+
+    @override_settings(THUMBNAIL_WORKERS=1)
+    def test_pool_failure_is_logged(self):
+        thumbnails._executor = None
+        self.addCleanup(setattr, thumbnails, '_executor', None)
+        product = Product(name='Cider', size='33cl', unit='bottle', image=self.upload())
+        with mock.patch('shop.thumbnails.render_variants', side_effect=OSError('truncated image')), \
+                self.assertLogs('shop.thumbnails', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+            # the done callback runs in the worker before it exits
+            thumbnails.get_executor().shutdown(wait=True)
+        self.assertEqual(str(logs.records[0].exc_info[1]), 'truncated image')
+
+    def test_form_keeps_original(self):
+        form = ProductForm(data={'name': 'Water', 'size': '50cl', 'unit': 'bottle'},
+                           files={'image': self.upload()})
+        self.assertTrue(form.is_valid(), form.errors)
+        product = form.save()
+        self.assertEqual(Image.open(product.image.path).size, (1000, 800))
+        self.assertEqual(product.image_widths, [])
+
+    def test_form_decodes_upload_once(self):
+        form = ProductForm(data={'name': 'Soda', 'size': '33cl', 'unit': 'can'},
+                           files={'image': self.upload()})
+        with mock.patch('PIL.Image.open', wraps=Image.open) as image_open:
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(image_open.call_count, 1)
+
+
+class SingleWriteSaveTestCase(TemporaryMediaMixin, TestCase):
+    """Saving a product or category is one INSERT/UPDATE and at most one upload."""
+
+    def assertWrites(self, func, queries, uploads):
+        # Storage.save is the entry point of every backend, S3 included
+        with CaptureQueriesContext(connection) as ctx, \
+                mock.patch.object(Storage, 'save', autospec=True, side_effect=Storage.save) as storage_save:
+            func()
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), queries, writes)
+        self.assertEqual(storage_save.call_count, uploads)
+
+    def test_create_with_image(self):
+        product = Product(name='Tea', size='30cl', unit='glass',
+                          image=SimpleUploadedFile('tea.jpg', b'jpg bytes'))
+        self.assertWrites(product.save, queries=1, uploads=1)
+        self.assertRegex(product.image.name, r'^product/[0-9a-f]{32}/tea\.jpg$')
+        self.assertEqual(product.get_prefix(), product.image.name[:-len('tea.jpg')])
+
+    def test_update_without_new_image(self):
+        category = MenuCategory.objects.create(name='Hot drinks', image=SimpleUploadedFile('hot.jpg', b'jpg bytes'))
+        category.description = 'Tea and coffee'
+        self.assertWrites(category.save, queries=1, uploads=0)
+
+    def test_replace_image(self):
+        category = MenuCategory.objects.create(name='Cold drinks', image=SimpleUploadedFile('cold.jpg', b'a'))
+        first = category.image.name
+        category.image = SimpleUploadedFile('cold.jpg', b'b')
+        self.assertWrites(category.save, queries=1, uploads=1)
+        self.assertNotEqual(category.image.name, first)
+
+    def test_create_without_image(self):
+        self.assertWrites(lambda: Product.objects.create(name='Ayran', size='20cl', unit='glass'), queries=1, uploads=0)
+
+
+class MenuImportExportTestCase(TemporaryMediaMixin, TestCase):
+    """Menus load and dump in bulk through the import_menu / export_menu commands."""
+
+    def write(self, name, content):
+        path = f'{self.media_root}/{name}'
+        with open(path, 'w' if isinstance(content, str) else 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_import_csv_with_bulk_writes(self):
+        rows = ['type,name,size,unit,description,category,price,is_active,section,image',
+                'section,Garden,,,,,,,,',
+                'table,G1,,,,,,,Garden,',
+                'category,Beers,,,Cold,,,,,beers.jpg']
+        rows += [f'item,Beer {i},50cl,draft,,Beers,{i}.50,true,,' for i in range(200)]
+        rows.append('item,Tap water,,glass,,,,,,')
+        path = self.write('menu.csv', '\n'.join(rows) + '\n')
+        self.write('beers.jpg', b'jpg bytes')
+
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('import_menu', path, stdout=StringIO())
+        # a few INSERTs per model (SQLite caps the parameters per statement), not one per row
+        self.assertLessEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 10)
+
+        self.assertEqual(Product.objects.count(), 201)
+        self.assertEqual(MenuItem.objects.count(), 200)
+        item = MenuItem.objects.select_related('product', 'category').get(product__name='Beer 7')
+        self.assertEqual((item.price, item.category.name, item.handle), (Decimal('7.50'), 'Beers', 'beer-7-50cl-draft'))
+        self.assertEqual(Table.objects.get(name='G1').section.name, 'Garden')
+        category = MenuCategory.objects.get(name='Beers')
+        self.assertEqual(category.handle, 'beers')
+        self.assertTrue(default_storage.exists(category.image.name))
+
+    def test_reimport_updates_in_place(self):
+        path = self.write('menu.jsonl', '\n'.join([
+            '{"type": "category", "name": "Wine"}',
+            '{"type": "item", "name": "Merlot", "size": "15cl", "unit": "glass", "category": "Wine", "price": "6"}',
+        ]))
+        call_command('import_menu', path, stdout=StringIO())
+        self.write('menu.jsonl', '{"type": "item", "name": "Merlot", "size": "15cl", "unit": "glass", '
+                                 '"category": "Wine", "price": "7", "is_active": false}\n')
+        call_command('import_menu', path, stdout=StringIO())
+        item = MenuItem.objects.get()
+        self.assertEqual((item.price, item.is_active), (Decimal('7.00'), False))
+
+    def test_reimport_bumps_table_versions(self):
+        section = Section.objects.create(name='Terrace')
+        table = Table.objects.create(name='T1', section=section)
+        url = reverse('available-tables-view', kwargs={'section_id': section.id})
+        etag = self.client.get(url, HTTP_HX_REQUEST='true')['ETag']
+        path = self.write('menu.jsonl', '{"type": "table", "name": "T1", "section": "Terrace", '
+                                        '"description": "By the window"}\n')
+        call_command('import_menu', path, stdout=StringIO())
+        table.refresh_from_db()
+        self.assertEqual((table.description, table.version), ('By the window', 1))
+        response = self.client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_category_rolls_back_batch(self):
+        path = self.write('menu.jsonl', '{"type": "item", "name": "Gin", "size": "4cl", "unit": "glass", '
+                                        '"category": "Spirits", "price": "9"}\n')
+        with self.assertRaisesMessage(CommandError, "Record 1: unknown category 'Spirits'."):
+            call_command('import_menu', path, stdout=StringIO())
+        self.assertFalse(Product.objects.exists())
+
+    def test_export_round_trip(self):
+        section = Section.objects.create(name='Bar')
+        Table.objects.create(name='B1', section=section)
+        category = MenuCategory.objects.create(name='Coffee')
+        product = Product.objects.create(name='Espresso', size='single', unit='glass')
+        MenuItem.objects.create(product=product, category=category, price=Decimal('2.50'))
+        for fmt in ('csv', 'jsonl'):
+            out = StringIO()
+            call_command('export_menu', '--format', fmt, stdout=out)
+            path = self.write(f'menu.{fmt}', out.getvalue())
+            output = StringIO()
+            call_command('import_menu', path, stdout=output)
+            self.assertIn('0 created, 5 updated', output.getvalue())
+
+
+class OrderExportTestCase(TestCase):
+    """The order history streams out as CSV or Parquet, a chunk at a time."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = MenuCategory(name='Mains')
+        category.save()
+        product = Product(name='Burger', size='single', unit='plate')
+        product.save()
+        menu_item = MenuItem.objects.create(product=product, category=category, price=Decimal('12.00'))
+        section = Section.objects.create(name='Hall')
+        table = Table.objects.create(name='H1', section=section)
+        cls.orders = []
+        for quantity in (1, 2, 3):
+            order = Order.objects.create(table=table)
+            OrderItem.objects.create(order=order, menu_item=menu_item, quantity=quantity)
+            cls.orders.append(order)
+        cls.empty_order = Order.objects.create(table=table)
+
+    def test_csv_streams(self):
+        response = self.client.get(reverse('order-export-view'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'order_id,created,table,section,is_finished,order_total,item_id,menu_item,quantity,price,is_delivered')
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[2].startswith(f'{self.orders[1].id},'))
+        self.assertTrue(lines[2].endswith(',Burger,2,12.00,False'))
+        self.assertTrue(lines[4].endswith(',,,,,'))
+
+    async def test_asgi_streams_chunk_by_chunk(self):
+        # one row per chunk, the ASGI handler must get them one at a time rather than a buffered list
+        csv_format = ('text/csv', 'csv', partial(csv_chunks, rows_per_chunk=1))
+        with mock.patch.dict(EXPORT_FORMATS, {'csv': csv_format}):
+            response = await self.async_client.get(reverse('order-export-view'))
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), 5)
+
+    def test_csv_chunks(self):
+        chunks = list(csv_chunks(order_rows(chunk_size=2), rows_per_chunk=2))
+        self.assertEqual(len(chunks), 3)
+
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        response = self.client.get(reverse('order-export-view'), {'format': 'parquet'})
+        table = pq.read_table(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(table.column('quantity').to_pylist(), [1, 2, 3, None])
+        self.assertEqual(table.column('order_total').to_pylist()[:3], [Decimal('12.00'), Decimal('24.00'), Decimal('36.00')])
+
+    def test_date_window(self):
+        Order.objects.filter(id=self.orders[0].id).update(created=timezone.now() - timedelta(days=10))
+        today = timezone.localdate()
+        response = self.client.get(reverse('order-export-view'), {'from': today - timedelta(days=1), 'to': today})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+        self.assertEqual(self.client.get(reverse('order-export-view'), {'from': today, 'to': today - timedelta(days=1)}).status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as root:
+            call_command('export_orders', f'{root}/orders.parquet', '--chunk-size', '2', stdout=StringIO())
+            import pyarrow.parquet as pq
+            self.assertEqual(pq.read_table(f'{root}/orders.parquet').num_rows, 4)
+
+
+class HistoricalOrdersPaginationTestCase(TestCase):
+    """The order history is paged by a (created, id) cursor at a constant query cost."""
+
+    @classmethod
+    def setUpTestData(cls):
+        section = Section.objects.create(name='Porch')
+        table = Table.objects.create(name='P1', section=section)
+        Order.objects.bulk_create([Order(table=table) for _ in range(120)])
+        # identical timestamps must not skip or repeat rows across pages
+        Order.objects.update(created=timezone.now())
+        cls.expected = list(Order.objects.order_by('-created', '-id').values_list('id', flat=True))
+
+    def fetch_all(self):
+        url = reverse('historical-orders-view')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_HX_REQUEST='true')
+        ids = [order.id for order in response.context['orders']]
+        while response.context['next_cursor']:
+            with self.assertNumQueries(1):
+                response = self.client.get(url, {'after': response.context['next_cursor']}, HTTP_HX_REQUEST='true')
+            self.assertTemplateUsed(response, 'partials/historical_orders_rows.html')
+            ids += [order.id for order in response.context['orders']]
+        return ids
+
+    def test_pages_cover_history_once(self):
+        self.assertEqual(self.fetch_all(), self.expected)
+
+    def test_first_page_renders_load_more(self):
+        response = self.client.get(reverse('historical-orders-view'))
+        self.assertEqual(len(response.context['orders']), 50)
+        self.assertContains(response, 'hx-trigger="revealed"')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('historical-orders-view'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTestCase(TestCase):
+    """Order and product search parse ids and days into exact lookups and rank text matches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        terrace = Section.objects.create(name='Terrace')
+        cls.table = Table.objects.create(name='T12', section=terrace)
+        cls.numbered = Table.objects.create(name='7', section=Section.objects.create(name='Inside'))
+        cls.order = Order.objects.create(table=cls.table)
+        cls.other = Order.objects.create(table=cls.numbered)
+        Order.objects.filter(id=cls.other.id).update(created=timezone.make_aware(datetime(2024, 5, 1, 20, 30)))
+        for name, size, unit in [('Pilsner', '50cl', 'draft'), ('Pilsner Urquell', '33cl', 'bottle'),
+                                 ('Pale ale', '50cl', 'draft'), ('Cola', '33cl', 'can')]:
+            Product.objects.create(name=name, size=size, unit=unit)
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query(' 42 ').number, 42)
+        self.assertEqual(parse_query('01.05.2024').day, date(2024, 5, 1))
+        self.assertEqual(parse_query('2024-05-01').day, date(2024, 5, 1))
+        self.assertEqual(parse_query('01.05').day, date(timezone.localdate().year, 5, 1))
+        parsed = parse_query('terrace   bar')
+        self.assertEqual((parsed.text, parsed.number, parsed.day), ('terrace bar', None, None))
+
+    def test_orders_by_id_day_and_name(self):
+        self.assertEqual(list(Order.objects.search(str(self.order.id))), [self.order])
+        # a number is also a table name
+        self.assertIn(self.other, Order.objects.search('7'))
+        self.assertEqual(list(Order.objects.search('2024-05-01')), [self.other])
+        self.assertEqual(list(Order.objects.search('terr')), [self.order])
+        self.assertEqual(list(Order.objects.search('t12')), [self.order])
+
+    def test_order_search_sql_has_no_casts_or_distinct(self):
+        sql = str(Order.objects.search('terrace').query).upper()
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('CAST', sql)
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite FTS5 index")
+    def test_products_ranked_and_limited(self):
+        names = [product.name for product in Product.objects.search('pils')]
+        self.assertEqual(sorted(names), ['Pilsner', 'Pilsner Urquell'])
+        self.assertEqual([p.name for p in Product.objects.search('pilsner bottle')], ['Pilsner Urquell'])
+        self.assertEqual(len(Product.objects.search('50cl', limit=1)), 1)
+        self.assertFalse(Product.objects.search('wine').exists())
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite FTS5 index")
+    def test_product_index_follows_writes(self):
+        product = Product.objects.get(name='Cola')
+        product.name = 'Ginger beer'
+        product.save()
+        self.assertEqual([p.name for p in Product.objects.search('ginger')], ['Ginger beer'])
+        self.assertFalse(Product.objects.search('cola').exists())
+        product.delete()
+        self.assertFalse(Product.objects.search('ginger').exists())
+
+    def test_postgres_product_search_uses_the_indexed_document(self):
+        postgres = PostgresDatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'},
+                                           alias='postgres')
+        products = search.PostgresSearchBackend().search_products(Product.objects.all(), 'pils bottle', 10)
+        sql, params = products.query.get_compiler(connection=postgres).as_sql()
+        sql = (sql % tuple(repr(param) for param in params)).replace('"shop_product".', '').replace('"', '')
+        document = import_module('shop.migrations.0030_product_document_indexes').DOCUMENT
+        for word in ('pils', 'bottle'):
+            self.assertIn(f"UPPER({document}::text) LIKE UPPER('%{word}%')", sql)
+            self.assertIn(f"{document} %> '{word}'", sql)
+        self.assertNotIn(' AS document', sql)
+
+    def test_trigram_threshold_is_set_per_connection(self):
+        postgres = mock.MagicMock(vendor='postgresql')
+        search.set_trigram_threshold(sender=None, connection=postgres)
+        postgres.cursor().__enter__().execute.assert_called_once_with(
+            "SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", ['0.3'])
+
+    def test_historical_view_search(self):
+        response = self.client.get(reverse('historical-orders-view'), {'q': 'terrace'}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['orders'], [self.order])
+
+
+class TableBookingTestCase(TestCase):
+    """Activating, switching and finalizing keep one open order per table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        section = Section.objects.create(name='Window')
+        cls.table = Table.objects.create(name='W1', section=section)
+        cls.other_table = Table.objects.create(name='W2', section=section)
+
+    def activate(self, table):
+        return self.client.post(reverse('activate-table-order-view', kwargs={'table_id': table.id}))
+
+    def test_activate_busy_table_conflicts(self):
+        self.assertEqual(self.activate(self.table).status_code, 200)
+        response = self.activate(self.table)
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, 'Table W1 is already in use.', status_code=409)
+        self.assertEqual(Order.objects.filter(table=self.table).count(), 1)
+        self.table.refresh_from_db()
+        self.assertTrue(self.table.in_use)
+
+    def test_stale_save_keeps_table_claimed(self):
+        stale = Table.objects.get(id=self.table.id)
+        self.activate(self.table)
+        stale.description = 'By the window'
+        stale.save()
+        self.table.refresh_from_db()
+        self.assertTrue(self.table.in_use)
+        self.assertEqual(self.table.description, 'By the window')
+        self.assertEqual(self.activate(self.table).status_code, 409)
+
+    def test_switch_to_busy_table_conflicts(self):
+        self.activate(self.table)
+        self.activate(self.other_table)
+        order = Order.objects.get(table=self.table)
+        session = self.client.session
+        session['order_id'] = order.id
+        session.save()
+        response = self.client.post(reverse('switch-table-order-view', kwargs={'table_id': self.other_table.id}))
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual(order.table_id, self.table.id)
+
+    def test_repeated_finalize_keeps_rebooked_table(self):
+        self.activate(self.table)
+        order = Order.objects.get(table=self.table)
+        url = reverse('finalize-order-view', kwargs={'order_id': order.id})
+        self.client.post(url)
+        self.activate(self.table)
+        self.client.post(url)
+        self.table.refresh_from_db()
+        self.assertTrue(self.table.in_use)
+
+
+class TableBookingStressTestCase(TransactionTestCase):
+    """Waiters racing for the same tables from many threads never double-book one."""
+
+    def retry(self, func):
+        for _ in range(100):
+            try:
+                return func()
+            except OperationalError:
+                # SQLite's shared-cache test database reports lock contention instead of waiting
+                time.sleep(0.01)
+
+    def assertBookedOnce(self, tables):
+        # a retried request may have won before its response was lost, so judge by the rows
+        for table in tables:
+            table.refresh_from_db()
+            self.assertTrue(table.in_use)
+            self.assertEqual(Order.objects.filter(table=table, is_finished=False).count(), 1)
+
+    def test_concurrent_activations(self):
+        section = Section.objects.create(name='Stress')
+        tables = [Table.objects.create(name=f'S{i}', section=section) for i in range(3)]
+        attempts = 8
+        barrier = threading.Barrier(len(tables) * attempts)
+        statuses = []
+
+        def activate(table):
+            try:
+                barrier.wait()
+                response = self.retry(lambda: Client().post(
+                    reverse('activate-table-order-view', kwargs={'table_id': table.id})))
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=activate, args=(table,)) for table in tables for _ in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(statuses), len(threads))
+        self.assertLessEqual(set(statuses), {200, 409})
+        self.assertBookedOnce(tables)
+        self.assertGreaterEqual(statuses.count(409), len(threads) - len(tables))
+
+    def test_edits_during_activations(self):
+        section = Section.objects.create(name='Edits')
+        tables = [Table.objects.create(name=f'E{i}', section=section) for i in range(3)]
+        attempts = 4
+        barrier = threading.Barrier(len(tables) * attempts * 2)
+        statuses = []
+
+        def activate(table):
+            try:
+                barrier.wait()
+                for _ in range(3):
+                    response = self.retry(lambda: Client().post(
+                        reverse('activate-table-order-view', kwargs={'table_id': table.id})))
+                    statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        def edit(table):
+            # loaded before the activations, like a table form opened earlier and saved now
+            stale = Table.objects.get(id=table.id)
+            try:
+                barrier.wait()
+                for i in range(3):
+                    stale.description = f'edit {i}'
+                    self.retry(stale.save)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=target, args=(table,))
+                   for table in tables for _ in range(attempts) for target in (activate, edit)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(set(statuses), {200, 409})
+        self.assertBookedOnce(tables)
+
+
+class FinishOpenOrdersTestCase(TestCase):
+    """Closing the day is set-based: the query count does not grow with the open orders."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = MenuCategory(name='Sides')
+        category.save()
+        product = Product(name='Fries', size='large', unit='plate')
+        product.save()
+        cls.menu_item = MenuItem.objects.create(product=product, category=category, price=Decimal('4.00'))
+        cls.section = Section.objects.create(name='Yard')
+
+    def open_orders(self, count, prefix):
+        tables = Table.objects.bulk_create(
+            [Table(name=f'{prefix}{i}', section=self.section, in_use=True) for i in range(count)]
+        )
+        orders = Order.objects.bulk_create([Order(table=table) for table in tables])
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, menu_item=self.menu_item, quantity=1, price=Decimal('4.00')) for order in orders]
+        )
+        return orders
+
+    def finish_all(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('finish-open-orders-view'))
+        return [q['sql'] for q in ctx.captured_queries]
+
+    def test_constant_queries(self):
+        self.open_orders(5, 'A')
+        few = self.finish_all()
+        self.open_orders(200, 'B')
+        many = self.finish_all()
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len([sql for sql in many if sql.startswith('UPDATE')]), 2)
+
+    def test_orders_finished_and_tables_freed(self):
+        orders = self.open_orders(3, 'C')
+        versions = dict(Order.objects.values_list('id', 'version'))
+        self.finish_all()
+        self.assertFalse(Order.objects.filter(is_finished=False).exists())
+        self.assertFalse(Table.objects.filter(in_use=True).exists())
+        for order in Order.objects.all():
+            self.assertEqual(order.version, versions[order.id] + 1)
+        self.assertEqual(HourlyOrderSales.objects.aggregate(Sum('orders'))['orders__sum'], len(orders))
+
+    def test_feed_told_in_bulk(self):
+        orders = self.open_orders(2, 'D')
+        with mock.patch.object(broker, 'publish') as publish, \
+                mock.patch.object(type(broker), 'has_subscribers', new_callable=mock.PropertyMock, return_value=True), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('finish-open-orders-view'))
+        self.assertEqual(sorted(call.args for call in publish.call_args_list),
+                         sorted(('order-finished', order.id) for order in orders))
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    """The benchmark covers every shop route and flags regressions against its baseline."""
+
+    def test_small_run_covers_every_route(self):
+        benchmarks.seed({'sections': 2, 'tables_per_section': 3, 'categories': 2, 'items_per_category': 3,
+                         'days': 3, 'orders_per_day': 4, 'open_orders': 2})
+        results = benchmarks.run(shop_urls.urlpatterns, iterations=1, warmup=0)
+        routes = {name.split(' ')[1] for name in results}
+        self.assertEqual(routes, {pattern.name for pattern in shop_urls.urlpatterns})
+        self.assertEqual(benchmarks.compare(results, {}), [])
+        # POSTs are rolled back, the seeded open orders are still open
+        self.assertEqual(Order.objects.filter(is_finished=False).count(), 2)
+
+    def test_compare_budgets(self):
+        baseline = {'GET x': {'status': 200, 'queries': 2, 'p50_ms': 10.0, 'p99_ms': 20.0}}
+        # latency alone never fails a run, it is only reported
+        slow = {'GET x': {'status': 200, 'queries': 2, 'p50_ms': 40.0, 'p99_ms': 90.0}}
+        self.assertEqual(benchmarks.compare(slow, baseline), [])
+        self.assertEqual(benchmarks.slower(slow, baseline), ['GET x: p50_ms 40.0, baseline 10.0'])
+        more_queries = {'GET x': {'status': 200, 'queries': 3, 'p50_ms': 10.0, 'p99_ms': 20.0}}
+        self.assertEqual(benchmarks.compare(more_queries, baseline), ['GET x: 3 queries, budget 2'])
+        moved = {'GET x': {'status': 404, 'queries': 2, 'p50_ms': 10.0, 'p99_ms': 20.0}}
+        self.assertEqual(benchmarks.compare(moved, baseline), ['GET x: status 404, baseline 200'])
+        broken = {'GET y': {'status': 500, 'queries': 0, 'p50_ms': 1.0, 'p99_ms': 1.0}}
+        self.assertEqual(benchmarks.compare(broken, baseline), ['GET y: status 500'])
+
+
+class LoadGeneratorTestCase(TransactionTestCase):
+    """The synthetic workload drives the order flow end to end, and its log replays."""
+
+    def test_waiter_flow_record_and_replay(self):
+        benchmarks.seed({'sections': 1, 'tables_per_section': 2, 'categories': 2, 'items_per_category': 2,
+                         'days': 1, 'orders_per_day': 2, 'open_orders': 0})
+        recorder = loadgen.run_synthetic(loadgen.DjangoClient, waiters=1, kitchens=0, duration=0.5, think=0)
+        views = {name for name, _, _ in recorder.samples}
+        self.assertTrue({'activate-table-order-view', 'order-item-create-view', 'finalize-order-view'} <= views)
+        self.assertEqual([status for _, status, _ in recorder.samples if status >= 500], [])
+        self.assertEqual(OrderItem.objects.filter(order__is_finished=False).count(), OrderItem.objects.filter(
+            order__is_finished=False, order__table__in_use=True).count())
+
+        log = StringIO()
+        loadgen.write_log(log, recorder.log)
+        log.seek(0)
+        entries = loadgen.read_log(log)
+        self.assertEqual(len(entries), len(recorder.samples))
+        self.assertEqual(entries[0]['actor'], 'waiter-0')
+        replayed = loadgen.replay(loadgen.DjangoClient, entries, speed=0)
+        self.assertEqual(len(replayed.samples), len(entries))
+
+    def test_summarize(self):
+        samples = [('a', 200, 10.0), ('a', 500, 30.0), ('b', 0, 5.0), ('b', 200, 1.0)]
+        rows = loadgen.summarize(samples, 2.0)
+        self.assertEqual(rows['a'], {'requests': 2, 'errors': 1, 'rps': 1.0, 'p50_ms': 10.0, 'p95_ms': 30.0,
+                                     'p99_ms': 30.0, 'max_ms': 30.0})
+        self.assertEqual(rows['b']['errors'], 1)
+        self.assertEqual(rows['total']['requests'], 4)
+
+
+class InstrumentationTestCase(TestCase):
+    """Server-Timing per request and per view totals, only while INSTRUMENTATION is on."""
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        section = Section.objects.create(name='Garden')
+        table = Table.objects.create(name='G1', section=section, in_use=True)
+        self.order = Order.objects.create(table=table)
+
+    def test_disabled(self):
+        response = self.client.get(reverse('open-orders-view'), HTTP_HX_REQUEST='true')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('instrumentation-stats-view')).status_code, 404)
+
+    @override_settings(INSTRUMENTATION=True, INSTRUMENTATION_TOKEN='secret')
+    def test_server_timing_and_stats(self):
+        client = Client()
+        response = client.get(reverse('open-orders-view'), HTTP_HX_REQUEST='true')
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="\d+ queries", dup;desc="\d+ duplicated", '
+                                                   r'tpl;dur=[\d.]+, s3;dur=0.0;desc="0 calls", total;dur=[\d.]+$')
+        totals = instrumentation.registry.snapshot()['open-orders-view']
+        self.assertEqual(totals['requests'], 1)
+        self.assertGreater(totals['queries'], 0)
+        self.assertGreater(totals['render_ms'], 0)
+
+        self.assertEqual(client.get(reverse('instrumentation-stats-view')).status_code, 403)
+        auth = {'HTTP_AUTHORIZATION': 'Bearer secret'}
+        self.assertEqual(client.get(reverse('instrumentation-stats-view'), **auth).json()['open-orders-view']['requests'], 1)
+        text = client.get(reverse('instrumentation-stats-view'), {'format': 'prometheus'}, **auth).content.decode()
+        self.assertIn('# TYPE shop_requests_total counter', text)
+        self.assertIn('shop_requests_total{view="open-orders-view"} 1', text)
+
+    def test_duplicate_queries(self):
+        self.assertEqual(instrumentation.fingerprint('SELECT * FROM t WHERE id = 4 AND name = \'a\''),
+                         instrumentation.fingerprint('SELECT *  FROM t WHERE id = %s AND name = \'b\''))
+        self.assertEqual(instrumentation.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         'SELECT * FROM t WHERE id IN (...)')
+        instrumentation.install()
+        stats, token = instrumentation.start()
+        try:
+            list(OrderItem.objects.all())
+            for pk in range(3):
+                Order.objects.filter(id=pk).first()
+        finally:
+            instrumentation.stop(token)
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(list(stats.duplicates().values()), [2])
+
+
+class AsgiTestCase(TemporaryMediaMixin, TestCase):
+    """The hot read paths run as async views, and nothing in the ASGI middleware stack forces a thread."""
+    media_settings = {'IMAGE_BACKEND': 'local'}
+
+    def setUp(self):
+        super().setUp()
+        self.category = MenuCategory.objects.create(name='Soft drinks', image=SimpleUploadedFile('soft.png', b'png bytes'))
+        self.product = Product.objects.create(name='Cola', size='33cl', unit='can',
+                                              image=SimpleUploadedFile('cola.png', b'cola bytes'))
+        self.menu_item = MenuItem.objects.create(product=self.product, category=self.category, price=Decimal('2.50'))
+
+    @override_settings(DEBUG=True, INSTRUMENTATION=True)
+    def test_middleware_is_not_adapted(self):
+        # in DEBUG, Django logs every sync/async adaptation of the middleware chain
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    async def test_files_views(self):
+        htmx = {'HX-Request': 'true'}
+        response = await self.async_client.get(
+            reverse('menu-category-files-view', kwargs={'category_id': self.category.id}), headers=htmx)
+        self.assertContains(response, self.category.get_image_url())
+        response = await self.async_client.get(
+            reverse('menu-item-files-view', kwargs={'menu_item_id': self.menu_item.id}), headers=htmx)
+        self.assertContains(response, self.product.get_image_url())
+        response = await self.async_client.get(
+            reverse('product-profile-files-view', kwargs={'handle': self.product.handle}), headers=htmx)
+        self.assertContains(response, self.product.get_image_url())
+        response = await self.async_client.get(
+            reverse('menu-item-files-view', kwargs={'menu_item_id': self.menu_item.id + 1}), headers=htmx)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_files_views_offer_thumbnails(self):
+        await Product.objects.filter(id=self.product.id).aupdate(image_widths=[160, 320])
+        await MenuCategory.objects.filter(id=self.category.id).aupdate(image_widths=[160])
+        htmx = {'HX-Request': 'true'}
+        product = await Product.objects.aget(id=self.product.id)
+        category = await MenuCategory.objects.aget(id=self.category.id)
+        for url, image in ((reverse('menu-category-files-view', kwargs={'category_id': category.id}), category),
+                           (reverse('menu-item-files-view', kwargs={'menu_item_id': self.menu_item.id}), product),
+                           (reverse('product-profile-files-view', kwargs={'handle': product.handle}), product)):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url, headers=htmx)
+                self.assertContains(response, f'srcset="{image.get_image_sources()["webp"]}"')
+                self.assertContains(response, f"{get_image_url(image, 160, 'jpg')} 160w")
+
+    async def test_image_and_batch_views(self):
+        response = await self.async_client.get(self.product.get_image_url())
+        self.assertEqual(response.content, b'cola bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        response = await self.async_client.get(
+            reverse('menu-category-images-view', kwargs={'category_handle': self.category.handle}))
+        self.assertEqual(response.json(), {'category': self.category.get_image_url(),
+                                           'items': {str(self.menu_item.id): self.product.get_image_url()}})
+
+    async def test_charts(self):
+        cache.clear()
+        response = await self.async_client.get(reverse('charts-view'), headers={'HX-Request': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.async_client.get(reverse('charts-view'))).status_code, 200)
+
+
+class MenuCacheTestCase(TestCase):
+    """Menu browsing is served from the cached menu tree, rebuilt after any menu write."""
+
+    def setUp(self):
+        self.category = MenuCategory.objects.create(name='Burgers')
+        self.product = Product.objects.create(name='Cheeseburger', size='200g', unit='plate')
+        self.item = MenuItem.objects.create(product=self.product, category=self.category, price=Decimal('9.50'))
+        hidden = Product.objects.create(name='Old burger', size='200g', unit='plate')
+        MenuItem.objects.create(product=hidden, category=self.category, price=Decimal('5.00'), is_active=False)
+
+    def test_browsing_makes_no_queries(self):
+        menu_cache.get_menu()
+        with self.assertNumQueries(0):
+            menu_cache.get_menu()
+            # htmx partials, the full pages also load the session
+            categories = self.client.get(reverse('menu-category-list-view'), HTTP_HX_REQUEST='true')
+            items = self.client.get(reverse('menu-item-list-view', kwargs={'category_handle': self.category.handle}),
+                                    HTTP_HX_REQUEST='true')
+        self.assertContains(categories, 'Burgers')
+        self.assertContains(items, 'Cheeseburger')
+        self.assertContains(items, '9.50')
+        self.assertNotContains(items, 'Old burger')
+        self.assertEqual(self.client.get(reverse('menu-item-list-view', kwargs={'category_handle': 'nope'}),
+                                         HTTP_HX_REQUEST='true').status_code, 404)
+
+    def test_rebuilt_after_writes(self):
+        first = menu_cache.get_menu()
+        self.item.price = Decimal('11.00')
+        self.item.save()
+        menu = menu_cache.get_menu()
+        self.assertIsNot(menu, first)
+        self.assertEqual(menu.category(self.category.handle).items[0].price, Decimal('11.00'))
+
+        self.product.name = 'Double cheeseburger'
+        self.product.save()
+        self.assertEqual(menu_cache.get_menu().category(self.category.handle).items[0].product.name,
+                         'Double cheeseburger')
+        self.category.delete()
+        self.assertIsNone(menu_cache.get_menu().category(self.category.handle))
+
+    def test_rebuilt_after_commit(self):
+        menu_cache.get_menu()
+        with self.captureOnCommitCallbacks() as callbacks:
+            MenuCategory.objects.create(name='Drinks')
+            # a worker reading before the commit
+            stale = menu_cache.get_menu()
+        for callback in callbacks:
+            callback()
+        self.assertIsNot(menu_cache.get_menu(), stale)
+
+    @mock.patch.multiple('shop.models', AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test',
+                         AWS_STORAGE_BUCKET_NAME='bucket')
+    @override_settings(IMAGE_BACKEND='presigned', MENU_CACHE_SECONDS=3600)
+    def test_snapshot_expires_before_its_presigned_urls(self):
+        self.product.image = 'product/1/burger.jpg'
+        self.product.save()
+        client = get_s3_client()
+        client.forget(self.product.image.name)
+        clock = [1000.0]
+        signatures = iter(range(10))
+        with mock.patch('s3.client.time.monotonic', lambda: clock[0]), \
+                mock.patch('shop.menu_cache.time.time', lambda: clock[0]), \
+                mock.patch.object(client.client, 'generate_presigned_url',
+                                  side_effect=lambda *args, **kwargs: f'https://bucket/burger.jpg?sig={next(signatures)}'):
+            expires = clock[0] + client.url_expires_in
+            client.presigned_url(self.product.image.name)
+            # the cached url is still handed out, close to its expiry
+            clock[0] = expires - client.url_expiry_margin - 10
+            menu = menu_cache.get_menu()
+            self.assertEqual(menu.category(self.category.handle).items[0].product.image_url,
+                             'https://bucket/burger.jpg?sig=0')
+            self.assertLessEqual(menu.built + menu.max_age, expires)
+            clock[0] = expires
+            fresh = menu_cache.get_menu()
+        self.assertIsNot(fresh, menu)
+        self.assertEqual(fresh.category(self.category.handle).items[0].product.image_url,
+                         'https://bucket/burger.jpg?sig=1')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                               'menu': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                        'LOCATION': 'menu-test'}},
+                       MENU_CACHE_ALIAS='menu')
+    def test_shared_cache(self):
+        menu = menu_cache.get_menu()
+        self.assertIsNotNone(caches['menu'].get(menu_cache.SHARED_MENU_KEY.format(menu.version)))
+        # another worker: an empty local snapshot, the shared one is used
+        menu_cache._menu = None
+        with self.assertNumQueries(0):
+            self.assertEqual(menu_cache.get_menu().categories, menu.categories)
+        # a write in another worker bumps the shared version
+        caches['menu'].set(menu_cache.SHARED_VERSION_KEY, 'elsewhere')
+        self.assertEqual(menu_cache.get_menu().version, 'elsewhere')
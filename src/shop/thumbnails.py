@@ -0,0 +1,131 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+from .images import get_image_store, variant_key
+from .menu_cache import invalidate_menu
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = (160, 320, 640)
+# (file extension, Pillow format, save options)
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP', {'quality': 75, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 75, 'optimize': True, 'progressive': True}),
+)
+# AVIF needs a Pillow built with libavif
+if features.check('avif'):
+    THUMBNAIL_FORMATS = (('avif', 'AVIF', {'quality': 50, 'speed': 8}),) + THUMBNAIL_FORMATS
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+
+def render_variants(content):
+    """
+    Decode the image once and encode every width in every format.
+    Returns the generated widths and {(width, ext): bytes}.
+    """
+    img = Image.open(BytesIO(content))
+    # JPEG can decode straight at a reduced scale
+    img.draft('RGB', (max(THUMBNAIL_WIDTHS), max(THUMBNAIL_WIDTHS)))
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    widths = [width for width in THUMBNAIL_WIDTHS if width < img.width] or [img.width]
+
+    variants = {}
+    # largest first, so every step downscales the previous, already small, variant
+    for width in sorted(widths, reverse=True):
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+        for ext, fmt, options in THUMBNAIL_FORMATS:
+            output = BytesIO()
+            img.save(output, format=fmt, **options)
+            variants[(width, ext)] = output.getvalue()
+    return sorted(widths), variants
+
+
+def variant_name(name, width, ext):
+    """Storage name of a resized variant of the uploaded file: product/1/cola-320.webp"""
+    return f"{os.path.splitext(name)[0]}-{width}.{ext}"
+
+
+def generate_thumbnails(model, pk, name, key, content):
+    """Write every variant of an uploaded image and record the widths on the row, unless the image changed since."""
+    widths, variants = render_variants(content)
+    store = get_image_store() if key else None
+    for (width, ext), data in variants.items():
+        if store is not None:
+            store.save(variant_key(key, width, ext), data)
+        else:
+            target = variant_name(name, width, ext)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(data))
+    model.objects.filter(pk=pk, image=name).update(image_widths=widths)
+    # a queryset update sends no signal
+    invalidate_menu()
+
+
+def delete_variants(name, key, widths):
+    """
+    Delete the variants of a replaced or cleared image. Hashed variants are shared by identical uploads,
+    they stay while a product or category still uses the key.
+    """
+    from .models import MenuCategory, Product
+
+    store = get_image_store() if key else None
+    if store is not None:
+        if Product.objects.filter(image_key=key).exists() or MenuCategory.objects.filter(image_key=key).exists():
+            return
+        store.delete([variant_key(key, width, ext) for width in widths for ext, _, _ in THUMBNAIL_FORMATS])
+    else:
+        for width in widths:
+            for ext, _, _ in THUMBNAIL_FORMATS:
+                default_storage.delete(variant_name(name, width, ext))
+
+
+def _run_in_pool(func, *args):
+    try:
+        func(*args)
+    finally:
+        # the worker thread opened its own connection
+        connections.close_all()
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Thumbnail job failed", exc_info=future.exception())
+
+
+def _submit(func, *args):
+    # an exception raised in the pool stays in the future unless something looks at it
+    get_executor().submit(_run_in_pool, func, *args).add_done_callback(_log_failure)
+
+
+def _schedule(func, *args):
+    """Run func once the transaction commits, in the pool (or inline with THUMBNAIL_WORKERS = 0)."""
+    if settings.THUMBNAIL_WORKERS:
+        transaction.on_commit(lambda: _submit(func, *args))
+    else:
+        transaction.on_commit(lambda: func(*args))
+
+
+def schedule_thumbnails(instance, content):
+    """Generate the variants of a new upload once it is committed."""
+    _schedule(generate_thumbnails, type(instance), instance.pk, instance.image.name, instance.image_key, content)
+
+
+def schedule_variant_cleanup(image):
+    """Delete the variants of image, a (name, key, widths) the row no longer uses, once that is committed."""
+    _schedule(delete_variants, *image)
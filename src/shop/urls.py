@@ -40,8 +40,13 @@ from .views import (ActivateTableOrderView,
                     TablesbySectionView,
                     MenuCategoryFilesView,
                     MenuItemFilesView,
+                    MenuCategoryImagesView,
+                    OrderExportView,
+                    ImageView,
                     UndeliveredItemsView,
-                    ChartsView,)
+                    UndeliveredItemsStreamView,
+                    ChartsView,
+                    InstrumentationStatsView,)
 
 urlpatterns = [
     path('', ActiveDashboardView.as_view(), name='home-view'),
@@ -53,11 +58,13 @@ urlpatterns = [
     path('order/finalize/<int:order_id>/', FinalizeOrderView.as_view(), name='finalize-order-view'),
     path('order/finish-all/', FinishOpenOrdersView.as_view(), name='finish-open-orders-view'),
     path('order/historical/', HistoricalOrdersView.as_view(), name='historical-orders-view'),
+    path('order/historical/export/', OrderExportView.as_view(), name='order-export-view'),
     ### OrderItem URLs
     path('order_item/create/<int:item_id>/', OrderItemCreateView.as_view(), name='order-item-create-view'),
     path('order_item/deliver/<int:item_id>/', DeliverOrderItemView.as_view(), name='deliver-order-item-view'),
     path('order_item/delete/<int:item_id>/', DeleteOrderItemView.as_view(), name='delete-order-item-view'),
     path('order_item/undelivered/', UndeliveredItemsView.as_view(), name='undelivered-items-view'),
+    path('order_item/undelivered/stream/', UndeliveredItemsStreamView.as_view(), name='undelivered-items-stream-view'),
     ### Table URLs
     path('tables/', TablesbySectionView.as_view(), name='tables-by-section-view'),
     path('tables/<int:table_id>/', TableDetailView.as_view(), name='table-detail-view'),
@@ -89,6 +96,8 @@ urlpatterns = [
     ### MenuCategory URLs
     path('menu/', MenuCategoryListView.as_view(), name='menu-category-list-view'),
     path('menu/files/img/<int:category_id>/', MenuCategoryFilesView.as_view(), name='menu-category-files-view'),
+    path('img/<path:key>', ImageView.as_view(), name='image-view'),
+    path('menu/files/img/batch/<str:category_handle>/', MenuCategoryImagesView.as_view(), name='menu-category-images-view'),
     path('menu/<str:category_handle>/', MenuItemListView.as_view(), name='menu-item-list-view'),
     path('menu-item/files/img/<int:menu_item_id>/', MenuItemFilesView.as_view(), name='menu-item-files-view'),
     path('menu-category/create/', MenuCategoryCreateView.as_view(), name='menu-category-create-view'),
@@ -97,4 +106,7 @@ urlpatterns = [
     
     ### Charts
     path('charts/', ChartsView.as_view(), name='charts-view'),
+
+    ### Instrumentation
+    path('metrics/', InstrumentationStatsView.as_view(), name='instrumentation-stats-view'),
 ]
@@ -17,13 +17,14 @@ def validate_file_size(value):
         raise ValidationError("The maximum file size that can be uploaded is 2MB")
     
 def validate_image(image):
-    # Check the file size
-    if image.size > 2 * 1024 * 1024:  # 2MB
-        raise ValidationError("The maximum file size that can be uploaded is 2MB")
+    # forms.ImageField has already decoded and verified the upload, don't open it twice
+    upload = getattr(image, '_file', None) or image
+    if getattr(upload, 'image', None) is not None:
+        return
 
     # Check if it's a valid image
     try:
         img = Image.open(image)
         img.verify()  # verify that it is, in fact an image
     except (IOError, SyntaxError) as e:
-        raise ValidationError('Invalid image') 
\ No newline at end of file
+        raise ValidationError('Invalid image')
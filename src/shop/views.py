@@ -1,40 +1,94 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
-from shop.models import Order, OrderItem, MenuCategory, MenuItem, Table, Product, Section
-from shop.forms import OrderItemForm, ProductForm, MenuCategoryForm, MenuItemForm, TableForm, SectionForm
+from shop.models import (Order, OrderItem, MenuCategory, MenuItem, Table, Product, Section,
+                         DailyMenuItemSales, DailyCategorySales, HourlyOrderSales)
+from shop.rollups import record_finished_orders, arollup_version
+from shop.exports import EXPORT_FORMATS, achunks, order_rows
+from shop.pagination import keyset_page
+from shop.menu_cache import get_menu
+from shop.forms import OrderItemForm, ProductForm, MenuCategoryForm, MenuItemForm, TableForm, SectionForm, ChartsFilterForm, OrderExportForm
 from django.contrib import messages
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
+from django.db import transaction
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django_htmx.http import HttpResponseClientRedirect
 import pathlib
 import mimetypes
-from django.db.models import Sum, F, Count
-from django.db.models.functions import TruncDate, ExtractHour, TruncMonth
+from django.db.models import Sum, F
+from django.db.models.functions import TruncMonth, TruncWeek
+from datetime import datetime, time, timedelta
 import plotly.express as px
-
-### s3
-import s3
-from order.env import config
+import asyncio
+from shop.feed import broker, format_event
+from shop.signals import publish_orders_finished
 from django.contrib.auth.mixins import LoginRequiredMixin
-
-AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
-AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
-AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default=None)  
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from shop.images import get_image_store, content_type, KEY_PATTERN, IMMUTABLE_CACHE_CONTROL
+from shop import instrumentation
+from django.conf import settings
+from shop.etags import open_orders_etag, undelivered_items_etag, order_items_etag, available_tables_etag
+
+
+def figure_json(fig):
+    """Plotly figure as JSON that is safe to embed in a <script type="application/json"> tag."""
+    return fig.to_json().replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
+def conditional_partial(etag_func):
+    """
+    Answer polled htmx partials with 304 Not Modified while their version signature is unchanged.
+    no-cache makes the browser revalidate every time instead of serving a stale copy.
+    """
+    def decorator(view_func):
+        view_func = condition(etag_func=etag_func)(view_func)
+        view_func = vary_on_headers('HX-Request')(view_func)
+        return cache_control(no_cache=True, private=True)(view_func)
+    return decorator
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    """get_object_or_404 for async views."""
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+def read_image(store, key):
+    """The bytes of an image of the store, None if it has none. Blocking, run it in a thread."""
+    body = store.open(key)
+    if body is None:
+        return None
+    try:
+        return body.read()
+    finally:
+        body.close()
 
 
 class ActiveDashboardView(View):
     """Home View that includes active orders and undelivered items."""
 
     def get(self, request):
-        today = timezone.now().date()
-        active_orders_today = Order.objects.filter(created__date=today)
-        active_orders_week = Order.objects.filter(created__week=today.isocalendar()[1])
-        total_gain = sum([order.total_bill for order in active_orders_today])
-        active_orders = Order.objects.filter(is_finished=False)
+        # Half-open [start, end) ranges, so the created indexes can be used.
+        day_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        day_end = day_start + timedelta(days=1)
+        week_start = day_start - timedelta(days=day_start.weekday())
+        week_end = week_start + timedelta(days=7)
+        active_orders_today = Order.objects.filter(created__gte=day_start, created__lt=day_end)
+        active_orders_week = Order.objects.filter(created__gte=week_start, created__lt=week_end)
+        total_gain = active_orders_today.aggregate(total=Sum('total'))['total'] or 0
+        active_orders = Order.objects.filter(is_finished=False).select_related('table__section')
         undelivered_items = OrderItem.objects.filter(
-            order__is_finished=False, is_delivered=False)
+            order__is_finished=False, is_delivered=False).select_related('menu_item__product', 'order__table')
         delivered_items_today = OrderItem.objects.filter(
-            is_delivered=True, created__date=today
+            is_delivered=True, created__gte=day_start, created__lt=day_end
         )
         context = {
             'active_orders': active_orders,
@@ -51,6 +105,7 @@ class ActiveDashboardView(View):
         return render(request, 'pages/new_home.html', context=context)
 
 
+@method_decorator(conditional_partial(undelivered_items_etag), name='get')
 class UndeliveredItemsView(View):
     """View for undelivered items."""
 
@@ -58,12 +113,46 @@ class UndeliveredItemsView(View):
         if not request.htmx:
             return redirect('home-view')
         undelivered_items = OrderItem.objects.filter(
-            order__is_finished=False, is_delivered=False)
+            order__is_finished=False, is_delivered=False).select_related('menu_item__product', 'order__table')
         context = {
             'undelivered_items': undelivered_items
         }
         return render(request, 'partials/undelivered_items_list.html', context=context)
 
+
+class UndeliveredItemsStreamView(View):
+    """Server-Sent Events feed of undelivered item changes. Served under ASGI only."""
+    keepalive_seconds = 15
+    # Streams are recycled so connections dropped without notice do not pile up; EventSource reconnects.
+    max_seconds = 300
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # A sync worker would be held for the lifetime of the stream. 204 tells EventSource
+            # not to reconnect, so the page falls back to polling UndeliveredItemsView.
+            return HttpResponse(status=204)
+        response = StreamingHttpResponse(self.stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self):
+        queue = broker.subscribe()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_seconds
+        try:
+            yield "retry: 3000\n\n"
+            while loop.time() < deadline:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            broker.unsubscribe(queue)
+
+
 class PartialOrderItemsListDeleteView(View):
     def get(self, request):
         order = request.order
@@ -74,6 +163,7 @@ class PartialOrderItemsListDeleteView(View):
         }
         return render(request, 'partials/order_items_list_delete.html', context)
 
+@method_decorator(conditional_partial(order_items_etag), name='get')
 class PartialOrderItemsListView(View):
     def get(self, request):
         order = request.order
@@ -99,28 +189,14 @@ class OrderDetailView(View):
 
 
 class MenuCategoryFilesView(View):
-    def get(self, request, category_id:int):
+    # Async like the other files views: tablets load one per tile. Presigned urls are signed locally, no S3 request.
+    async def get(self, request, category_id:int):
         if not request.htmx:
             return redirect('menu-category-list-view')
-        category = get_object_or_404(MenuCategory, id=category_id)
-        if category.image:
-            client = s3.S3Client(aws_access_key_id=AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                    default_bucket_name=AWS_STORAGE_BUCKET_NAME).client
-            try:
-                client.head_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=category.image.name)
-                url = client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': AWS_STORAGE_BUCKET_NAME,
-                        'Key': category.image.name
-                    },
-                    ExpiresIn=1000
-                )
-                is_image = True
-            except:
-                url = None
-                is_image = False
+        category = await aget_object_or_404(MenuCategory.objects.all(), id=category_id)
+        # image.name is only written after the storage upload succeeded, so it records existence.
+        url = category.get_image_url()
+        is_image = url is not None
         data = {
                 'category': category,
                 'is_image': is_image,
@@ -133,12 +209,11 @@ class MenuCategoryFilesView(View):
         return render(request, 'partials/menu_category_files.html', context=context)
 
 class MenuCategoryListView(View):
-    """View for menu categories."""
+    """View for menu categories, from the cached menu."""
 
     def get(self, request):
-        qs = MenuCategory.objects.all()
         context = {
-            'categories': qs,
+            'categories': get_menu().categories,
         }
         if request.htmx:
             #context['order'] = request.order
@@ -146,28 +221,12 @@ class MenuCategoryListView(View):
         return render(request, 'pages/menu_categories_list.html', context=context)
     
 class MenuItemFilesView(View):
-    def get(self, request, menu_item_id:int):
+    async def get(self, request, menu_item_id:int):
         if not request.htmx:
             return redirect('menu-category-list-view')
-        menu_item = get_object_or_404(MenuItem, id=menu_item_id)
-        if menu_item.product.image:
-            client = s3.S3Client(aws_access_key_id=AWS_ACCESS_KEY_ID,
-                                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                                default_bucket_name=AWS_STORAGE_BUCKET_NAME).client
-            try:
-                client.head_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=menu_item.product.image.name)
-                url = client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': AWS_STORAGE_BUCKET_NAME,
-                        'Key': menu_item.product.image.name
-                    },
-                    ExpiresIn=1000
-                )
-                is_image = True
-            except:
-                url = None
-                is_image = False
+        menu_item = await aget_object_or_404(MenuItem.objects.select_related('product'), id=menu_item_id)
+        url = menu_item.product.get_image_url()
+        is_image = url is not None
         data = {
             'menu_item': menu_item,
             'is_image': is_image,
@@ -180,15 +239,45 @@ class MenuItemFilesView(View):
         return render(request, 'partials/menu_items_files.html', context=context)
 
 
+class ImageView(View):
+    """Serves a content-hashed image; the key changes with the content, so it is cached forever."""
+
+    async def get(self, request, key:str):
+        store = get_image_store()
+        if store is None or not KEY_PATTERN.match(key):
+            raise Http404
+        # S3 get_object (or a disk read) in a worker thread, the event loop keeps serving other tablets
+        body = await sync_to_async(read_image, thread_sensitive=False)(store, key)
+        if body is None:
+            raise Http404
+        response = HttpResponse(body, content_type=content_type(key))
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+class MenuCategoryImagesView(View):
+    """Every image url of a category and its active menu items, in one response."""
+
+    async def get(self, request, category_handle:str):
+        category = await aget_object_or_404(MenuCategory.objects.all(), handle=category_handle)
+        items = category.menuitem_set.filter(is_active=True).select_related('product')
+        data = {
+            'category': category.get_image_url(),
+            'items': {item.id: item.product.get_image_url() async for item in items},
+        }
+        return JsonResponse(data)
+
+
 class MenuItemListView(View):
-    """View for menu item based on the selected category."""
+    """View for menu item based on the selected category, from the cached menu."""
 
     def get(self, request, category_handle:str):
-        category = MenuCategory.objects.get(handle=category_handle)
-        items = category.menuitem_set.all().filter(is_active=True)
+        category = get_menu().category(category_handle)
+        if category is None:
+            raise Http404
         context = {
             'category': category,
-            'items': items
+            'items': category.items
         }
         if request.htmx:
             return render(request, 'partials/menu_items_list.html', context=context)
@@ -225,23 +314,22 @@ class OrderItemCreateView(View):
         }
         if quantity is not None:
             if all([quantity.isdigit(), int(quantity) > 0]):
-                order_item = OrderItem.objects.create(
+                OrderItem.objects.create(
                     order=order, menu_item=menu_item, quantity=int(quantity))
-                order_item.save()
                 return render(request, 'partials/order_items_list.html', context)
         if form.is_valid():
             quantity = form.cleaned_data['quantity']
-            order_item = OrderItem.objects.create(
+            OrderItem.objects.create(
                 order=order, menu_item=menu_item, quantity=quantity)
-            order_item.save()
             return render(request, 'partials/order_items_list.html', context)
 
 
+@method_decorator(conditional_partial(open_orders_etag), name='get')
 class OpenOrdersView(View):
     """View for open orders."""
 
     def get(self, request):
-        active_orders = Order.objects.filter(is_finished=False)
+        active_orders = Order.objects.filter(is_finished=False).select_related('table__section')
         context = {
             'active_orders': active_orders
         }
@@ -259,6 +347,7 @@ class AvailableSectionsView(View):
         }
         return render(request, 'partials/available_sections_list.html', context=context)
 
+@method_decorator(conditional_partial(available_tables_etag), name='get')
 class AvailableTablesView(View):
     """View for available tables."""
 
@@ -273,35 +362,49 @@ class SwitchOrderTableView(View):
     """View for switching table of order."""
 
     def post(self, request, table_id:int):
-        order = request.order
-        old_table = order.table
-        new_table = Table.objects.get(id=table_id)
-        order.table = new_table
-        order.save()
-        old_table.in_use = False
-        old_table.save()
-        new_table.in_use = True
-        new_table.save()
+        with transaction.atomic():
+            # serializes concurrent switches of the same order
+            order = Order.objects.select_for_update().select_related('table').get(id=request.order.id)
+            new_table = get_object_or_404(Table, id=table_id)
+            if order.is_finished:
+                return self.conflict(order, "Order is already finalized.")
+            if new_table.id != order.table_id:
+                if not Table.objects.filter(id=new_table.id).claim():
+                    return self.conflict(order, f"Table {new_table.name} was just taken.")
+                old_table_id = order.table_id
+                order.table = new_table
+                order.save()
+                Table.objects.filter(id=old_table_id).release()
         context = {
             'order': order
         }
         return render(request, 'partials/order_info.html', context)
 
+    def conflict(self, order, message):
+        context = {
+            'order': order,
+            'conflict': message,
+        }
+        return render(self.request, 'partials/order_info.html', context, status=409)
+
     
 class ActivateTableOrderView(View):
     """View for activating table order."""
 
     def post(self, request, table_id:int):
-        table = Table.objects.get(id=table_id)
-        table.in_use = True
-        table.save()
-        order = Order.objects.create(table=table)
-        order.save()
-        active_orders = Order.objects.filter(is_finished=False)
+        table = get_object_or_404(Table, id=table_id)
+        with transaction.atomic():
+            # only one of several waiters racing for the table gets it
+            claimed = Table.objects.filter(id=table.id).claim()
+            if claimed:
+                Order.objects.create(table=table)
+        active_orders = Order.objects.filter(is_finished=False).select_related('table__section')
         context = {
             'active_orders': active_orders
         }
-
+        if not claimed:
+            context['conflict'] = f"Table {table.name} is already in use."
+            return render(request, "partials/open_orders_list.html", context, status=409)
         return render(request, "partials/open_orders_list.html", context)
     
 
@@ -332,7 +435,7 @@ class DeleteOrderItemView(View):
             messages.error(request, "Can't delete, order is already finalized.")
             return render(request, 'partials/messages_template.html', {})
         order_items = order.orderitem_set.all()
-        order_item = OrderItem.objects.get(id=item_id)
+        order_item = get_object_or_404(order.orderitem_set, id=item_id)
         order_item.delete()
         context={
             'order': order,
@@ -345,12 +448,14 @@ class FinalizeOrderView(View):
     """View for finalizing order."""
 
     def post(self, request, order_id):
-        order = Order.objects.get(id=order_id)
-        order.is_finished = True
-        order.save()
-        table = order.table
-        table.in_use = False
-        table.save()
+        with transaction.atomic():
+            order = get_object_or_404(Order.objects.select_for_update(), id=order_id)
+            # only the request that finishes the order frees its table, a repeat must not free a re-booked table
+            if not order.is_finished:
+                order.is_finished = True
+                order.save()
+                Table.objects.filter(id=order.table_id).release()
+                record_finished_orders([order.id])
         context = {
             'order': order
         }
@@ -598,33 +703,16 @@ class MenuItemListView2(View):
 
 
 class ProductProfileFilesView(View):
-    def get(self, request, handle:str):
+    async def get(self, request, handle:str):
         if not request.htmx:
             return redirect('home-view')
-        product = Product.objects.get(handle=handle)
+        product = await aget_object_or_404(Product.objects.all(), handle=handle)
         data = {}
         if product.image:
-            client = s3.S3Client(aws_access_key_id=AWS_ACCESS_KEY_ID,
-                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                    default_bucket_name=AWS_STORAGE_BUCKET_NAME).client
-            try:
-                client.head_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key=product.image.name)
-                url = client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': AWS_STORAGE_BUCKET_NAME,
-                        'Key': product.image.name
-                    },
-                    ExpiresIn=1000
-                )
-                is_image = True
-            except:
-                url = None
-                is_image = False
             data = {
                 'product': product,
-                'is_image': is_image,
-                'url': url
+                'is_image': True,
+                'url': product.get_image_url()
             }
 
         context = {
@@ -846,7 +934,7 @@ class TableEditView(View):
             'table': table,
             'form': form
         }
-        return render(request, 'partials/table_detail.html', context=context)
+        return render(request, 'forms/table_edit_form.html', context=context)
     
 class TableDeleteView(LoginRequiredMixin, View):
     raise_exception = True
@@ -857,115 +945,187 @@ class TableDeleteView(LoginRequiredMixin, View):
         return redirect('tables-by-section-view')
 
 class HistoricalOrdersView(View):
+    """Order history, newest first, a keyset page at a time; ?after= loads the rows of the next page."""
+    page_size = 50
+
     def get(self, request):
-        orders = Order.objects.all().order_by('-created')
+        orders = Order.objects.select_related('table__section')
         q = request.GET.get('q')
         if q:
             orders = orders.search(q)
+        after = request.GET.get('after')
+        try:
+            page, next_cursor = keyset_page(orders, after, self.page_size)
+        except ValueError:
+            return HttpResponse('Invalid cursor.', status=400)
         context = {
-            'orders': orders
+            'orders': page,
+            'next_cursor': next_cursor,
+            'q': q or '',
         }
         if request.htmx:
+            if after:
+                return render(request, 'partials/historical_orders_rows.html', context)
             return render(request, 'partials/historical_orders_list.html', context)
         return render(request, 'pages/historical_orders_page.html', context)
     
+class OrderExportView(View):
+    """Streams the order history with its items as CSV or Parquet, ?format=csv|parquet&from=&to=."""
+
+    def get(self, request):
+        form = OrderExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponse(form.errors.as_text(), status=400)
+        content_type, extension, encode = EXPORT_FORMATS[form.cleaned_data['format']]
+        chunks = encode(order_rows(form.cleaned_data['from'], form.cleaned_data['to']))
+        if isinstance(request, ASGIRequest):
+            chunks = achunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{extension}"'
+        return response
+
+
 class FinishOpenOrdersView(View):
+    """Closes the day: every open order finished and every table freed in two UPDATEs."""
+
     def post(self, request):
-        active_orders = Order.objects.filter(is_finished=False)
-        for order in active_orders:
-            order.is_finished = True
-            order.save()
-            table = order.table
-            table.in_use = False
-            table.save()
+        with transaction.atomic():
+            order_ids = Order.objects.finish()
+            record_finished_orders(order_ids)
+            publish_orders_finished(order_ids)
         return render(request, 'partials/open_orders_list.html', {})
     
 
-class ChartsView(View):
-    def get(self, request):
-        if request.htmx:
-            revenue_by_date = OrderItem.objects.annotate(
-                date_only=TruncDate('created')
-            ).values('date_only').annotate(revenue=Sum(F('menu_item__price') * F('quantity')))
-
-            x = revenue_by_date.values_list('date_only', flat=True)
-            y = revenue_by_date.values_list('revenue', flat=True)
-
-            fig = px.line(
-                x=x,
-                y=y,
-                labels={'x': 'Date', 'y': 'Revenue'},
-            )
-            fig.update_layout(
-                xaxis_title="Date",
-                yaxis_title="Revenue",
-                dragmode=False,
-            )
-            fig.update_traces(mode="markers+lines", textposition='top center')
-            chart = fig.to_html()
-
-            quantity_by_product = OrderItem.objects.values('menu_item__product__name', 'menu_item__product__unit' , 'menu_item__product__size').annotate(quantity=Sum('quantity'))
-            x1 = [f"{item['menu_item__product__name']} {item['menu_item__product__size']} {item['menu_item__product__unit']}" for item in quantity_by_product]
-            y1 = quantity_by_product.values_list('quantity', flat=True)
-            fig1 = px.bar(
-                x=x1,
-                y=y1,
-                labels={'x': 'Product', 'y': 'Quantity'},
-                text_auto=True,
-            )
-            fig1.update_traces(textposition='outside')
-            fig1.update_layout(
-                dragmode=False,
-            )
-            chart2 = fig1.to_html()
-
-            orders_by_time = Order.objects.annotate(hour=ExtractHour('created')).values('hour').annotate(count=Count('id'))
-            x2 = orders_by_time.values_list('hour', flat=True)
-            y2 = orders_by_time.values_list('count', flat=True)
-            fig2 = px.bar(
-                x=x2,
-                y=y2,
-                labels={'x': 'Hour of the day', 'y': 'Orders'},
-                text_auto=True,
-            )
-            fig2.update_layout(
-                dragmode=False,
-            )
-            fig2.update_xaxes(
-                range=[0, 24],
-            )
-            fig2.update_traces(textposition='outside')
-            chart3 = fig2.to_html()
-
-            revenue_by_category = OrderItem.objects.values('menu_item__category__name').annotate(revenue=Sum(F('menu_item__price') * F('quantity')))
-            x3 = revenue_by_category.values_list('menu_item__category__name', flat=True)
-            y3 = revenue_by_category.values_list('revenue', flat=True)
-            fig3 = px.bar(
-                x=x3,
-                y=y3,
-                labels={'x': 'Category', 'y': 'Revenue'},
-                text_auto=True,
-            )
-            fig3.update_layout(
-                dragmode=False,
-            )
-
-            fig3.update_traces(textposition='outside')
-
-            chart4 = fig3.to_html()
-            context = {
-                'chart': chart,
-                'chart2': chart2,
-                'chart3': chart3,
-                'chart4': chart4
-            }
-            return render(request, 'partials/charts_partial.html', context)
-
+class InstrumentationStatsView(View):
+    """
+    Per view totals of this process recorded by InstrumentationMiddleware, as JSON or, with
+    ?format=prometheus, in the Prometheus text format. For staff users or the INSTRUMENTATION_TOKEN bearer.
+    """
 
-        return render(request, 'pages/charts_page.html', {})
-    
+    def get(self, request):
+        if not settings.INSTRUMENTATION:
+            raise Http404
+        token = settings.INSTRUMENTATION_TOKEN
+        authorized = request.user.is_staff or (token and request.headers.get('Authorization') == f'Bearer {token}')
+        if not authorized:
+            return HttpResponse(status=403)
+        snapshot = instrumentation.registry.snapshot()
+        if request.GET.get('format') == 'prometheus':
+            return HttpResponse(instrumentation.prometheus_text(snapshot),
+                                content_type='text/plain; version=0.0.4; charset=utf-8')
+        return JsonResponse(snapshot)
 
 
+class ChartsView(View):
+    """Charts page. The htmx request gets the figures as JSON, cached per rollup data version and date window."""
+    cache_seconds = 60 * 60
 
+    async def get(self, request):
+        form = ChartsFilterForm(request.GET)
+        if request.htmx:
+            if not form.is_valid():
+                return HttpResponse(form.errors.as_text(), status=400)
+            window = form.cleaned_data
+            key = "charts:{}:{}:{}:{}".format(await arollup_version(), window['from'], window['to'], window['granularity'])
+            html = await cache.aget(key)
+            if html is None:
+                # the rollup queries and plotly figures are sync, build them in a thread on a cache miss only
+                html = await sync_to_async(self.render_charts)(window)
+                await cache.aset(key, html, self.cache_seconds)
+            return HttpResponse(html)
+        return render(request, 'pages/charts_page.html', {'form': form if request.GET else ChartsFilterForm()})
+
+    def render_charts(self, window):
+        return render_to_string('partials/charts_partial.html', self.get_charts_context(**window))
+
+    def get_revenue_by_period(self, hourly, granularity):
+        """Revenue per hour, day, week or month. Hours come straight from the hourly rollup."""
+        if granularity == 'hour':
+            rows = hourly.values('date', 'hour').annotate(revenue=Sum('revenue')).order_by('date', 'hour')
+            return [(datetime.combine(row['date'], time(row['hour'])), row['revenue']) for row in rows]
+        if granularity == 'day':
+            rows = hourly.values(period=F('date'))
+        else:
+            trunc = TruncWeek if granularity == 'week' else TruncMonth
+            rows = hourly.annotate(period=trunc('date')).values('period')
+        rows = rows.annotate(revenue=Sum('revenue')).order_by('period')
+        return [(row['period'], row['revenue']) for row in rows]
+
+    def get_charts_context(self, **window):
+        """Build the four figures from the rollups, limited to the from/to window (dates, inclusive)."""
+        date_range = (window['from'], window['to'])
+        hourly = HourlyOrderSales.objects.filter(date__range=date_range)
+        revenue_by_period = self.get_revenue_by_period(hourly, window['granularity'])
+
+        x = [period for period, revenue in revenue_by_period]
+        y = [revenue for period, revenue in revenue_by_period]
+
+        fig = px.line(
+            x=x or None,
+            y=y or None,
+            labels={'x': window['granularity'].title(), 'y': 'Revenue'},
+        )
+        fig.update_layout(
+            xaxis_title=window['granularity'].title(),
+            yaxis_title="Revenue",
+            dragmode=False,
+        )
+        fig.update_traces(mode="markers+lines", textposition='top center')
+        chart = figure_json(fig)
+
+        quantity_by_product = list(DailyMenuItemSales.objects.filter(date__range=date_range).values('menu_item__product__name', 'menu_item__product__unit' , 'menu_item__product__size').annotate(quantity=Sum('quantity')))
+        x1 = [f"{item['menu_item__product__name']} {item['menu_item__product__size']} {item['menu_item__product__unit']}" for item in quantity_by_product]
+        y1 = [item['quantity'] for item in quantity_by_product]
+        fig1 = px.bar(
+            x=x1 or None,
+            y=y1 or None,
+            labels={'x': 'Product', 'y': 'Quantity'},
+            text_auto=True,
+        )
+        fig1.update_traces(textposition='outside')
+        fig1.update_layout(
+            dragmode=False,
+        )
+        chart2 = figure_json(fig1)
+
+        orders_by_time = list(hourly.values('hour').annotate(count=Sum('orders')).order_by('hour'))
+        x2 = [row['hour'] for row in orders_by_time]
+        y2 = [row['count'] for row in orders_by_time]
+        fig2 = px.bar(
+            x=x2 or None,
+            y=y2 or None,
+            labels={'x': 'Hour of the day', 'y': 'Orders'},
+            text_auto=True,
+        )
+        fig2.update_layout(
+            dragmode=False,
+        )
+        fig2.update_xaxes(
+            range=[0, 24],
+        )
+        fig2.update_traces(textposition='outside')
+        chart3 = figure_json(fig2)
+
+        revenue_by_category = list(DailyCategorySales.objects.filter(date__range=date_range).values('category__name').annotate(revenue=Sum('revenue')))
+        x3 = [row['category__name'] for row in revenue_by_category]
+        y3 = [row['revenue'] for row in revenue_by_category]
+        fig3 = px.bar(
+            x=x3 or None,
+            y=y3 or None,
+            labels={'x': 'Category', 'y': 'Revenue'},
+            text_auto=True,
+        )
+        fig3.update_layout(
+            dragmode=False,
+        )
 
+        fig3.update_traces(textposition='outside')
 
+        chart4 = figure_json(fig3)
+        context = {
+            'chart': chart,
+            'chart2': chart2,
+            'chart3': chart3,
+            'chart4': chart4
+        }
+        return context